@@ -3,16 +3,20 @@
 ####################################################################################################
 
 ### Imported modules ###
-import re, math, traceback, os
+import re, math, traceback, os, hashlib, json, subprocess
 from sys import exit
 from signal import signal, SIGTERM, SIGINT
 from os import path, remove, makedirs, listdir
 from shutil import rmtree
 from datetime import datetime, timedelta
 from time import time, sleep, strptime, mktime, strftime
-from threading import Thread, Lock, Timer
+from threading import Thread, Lock, Timer, Event
 from operator import itemgetter
+from heapq import heappush, heappop, heapify
 from collections import OrderedDict
+from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor, wait
+from types import MappingProxyType
 from random import randint
 from telegram import (Update, InputMediaPhoto, InlineKeyboardButton, InlineKeyboardMarkup,
 	ChatPermissions, ParseMode, ChatAction)
@@ -28,7 +32,9 @@ except Exception as e:
 	print("Exit.\n")
 	exit(0)
 
-from tsjson import TSjson
+from tsjson import TSjson, RWLock, encode
+from tssqlite import TSsqlite, migrate_database
+from invite_checker import InviteChecker
 from lib.multicolor_captcha_generator.img_captcha_gen import CaptchaGenerator
 from telegram.error import (TelegramError, Unauthorized, BadRequest, 
 							TimedOut, ChatMigrated, NetworkError)
@@ -36,7 +42,48 @@ from telegram.error import (TelegramError, Unauthorized, BadRequest,
 ####################################################################################################
 
 ### Globals ###
-files_config_list = []
+chats_config_files = {}
+chats_config_files_lock = Lock()
+chats_config_db = None
+chats_state_db = None
+chats_config_locks = [RWLock() for _ in range(CONST["CONFIG_LOCK_STRIPES"])]
+chats_manifest_dirty = False
+chats_config_cache = OrderedDict()
+chats_config_cache_lock = Lock()
+chats_config_update_locks = [RWLock() for _ in range(CONST["CONFIG_LOCK_STRIPES"])]
+chats_config_dirty = OrderedDict()
+chats_config_flush_lock = Lock()
+users_state = {}
+users_state_lock = Lock()
+users_state_flush_lock = Lock()
+users_state_dirty = set()
+users_state_file = None
+users_state_compact = False
+users_legacy_ids = set()
+shutdown_requested = Event()
+muted_users = {}
+beginner_users = {}
+muted_users_expiry = []
+muted_users_expiry_limit = 1024
+muted_users_dirty = set()
+muted_users_stale = set()
+muted_users_lock = Lock()
+chats_admins = {}
+chats_admins_pending = {}
+chats_admins_failed = {}
+chats_admins_lock = Lock()
+admins_groups = {}
+invite_checker = None
+invite_links_pool = {}
+invite_links_demand = {}
+invite_links_pool_lock = Lock()
+protection_pending = {}
+protection_pending_lock = Lock()
+protection_link_locks = [Lock() for _ in range(CONST["CONFIG_LOCK_STRIPES"])]
+groups_lists = None
+groups_lists_markup = {}
+groups_lists_lock = Lock()
+admins_executor = ThreadPoolExecutor(max_workers=CONST["ADMINS_FETCH_WORKERS"])
 to_delete_in_time_messages_list = []
 to_delete_join_messages_list = []
 new_users_list = []
@@ -49,11 +96,24 @@ CaptchaGen = CaptchaGenerator(2)
 
 ### Termination signals handler for program process ###
 def signal_handler(signal,  frame):
-	'''Termination signals (SIGINT, SIGTERM) handler for program process'''
+	'''Termination signals (SIGINT, SIGTERM) handler for program process. It just requests the
+	shutdown, the main loop releases the resources (the handler runs in the main thread, so it
+	can not take any lock that the main loop could be holding)'''
 	printts("Termination signal received. Releasing resources (Waiting for files to be closed)")
-	# Acquire all messages and users files mutex to ensure not read/write operation on them
-	for chat_config_file in files_config_list:
-		chat_config_file["File"].lock.acquire()
+	shutdown_requested.set()
+
+
+def release_resources():
+	'''Write all pending changes and close the program (called from the main loop on shutdown)'''
+	# Write all pending changes and apply all journals to the chats configuration files
+	save_muted_users()
+	flush_config_changes()
+	sync_config_journals(compact=True)
+	flush_users_state(compact=True)
+	save_chats_manifest()
+	# Acquire all chats files mutex to ensure not read/write operation on them
+	for chat_lock in chats_config_locks:
+		chat_lock.acquire()
 	printts("All resources successfully released.")
 	# Close the program
 	printts("Exit")
@@ -69,34 +129,142 @@ signal(SIGINT, signal_handler)  # SIGINT (Ctrl+C) to signal_handler
 ### General functions ###
 
 def initialize_resources():
-	'''Initialize resources by populating files list with chats found files'''
-	global files_config_list
+	'''Initialize resources by registering all known chats (chats files are opened on demand)'''
+	global chats_config_db
+	global chats_state_db
+	global chats_manifest_dirty
+	init_times = OrderedDict()
+	t0 = time()
 	# Remove old captcha directory and create it again
 	if path.exists(CONST["CAPTCHAS_DIR"]):
 		rmtree(CONST["CAPTCHAS_DIR"])
 	makedirs(CONST["CAPTCHAS_DIR"])
-	# Create data directory if it does not exists
-	if not path.exists(CONST["CHATS_DIR"]):
-		makedirs(CONST["CHATS_DIR"])
+	init_times["captchas dir"] = time() - t0
+	t0 = time()
+	# Open chats configurations database and register all stored chats (no directory scan)
+	if CONST["CONFIG_BACKEND"] == "sqlite":
+		# One-shot migration of the JSON chats files tree into a new database
+		if not path.exists(CONST["F_CONF_DB"]) and path.exists(CONST["CHATS_DIR"]):
+			num_chats, _ = migrate_database(CONST["CHATS_DIR"], CONST["F_CONF_DB"],
+					[("chats", CONST["F_CONF"]), ("chats_state", CONST["F_STATE"])])
+			printts("Migrated {} chats configurations to database.".format(num_chats))
+		chats_config_db = TSsqlite(CONST["F_CONF_DB"])
+		chats_state_db = TSsqlite(CONST["F_CONF_DB"], "chats_state")
+		chats_ids = chats_config_db.chats_ids()
 	else:
-		# If chats directory exists, check all subdirectories names (chats ID)
-		files = listdir(CONST["CHATS_DIR"])
-		if files:
-			for f_chat_id in files:
-				# Populate config files list
-				file_path = "{}/{}/{}".format(CONST["CHATS_DIR"], f_chat_id, CONST["F_CONF"])
-				files_config_list.append(OrderedDict([("ID", f_chat_id),
-					("File", TSjson(file_path))]))
-				# Create default configuration file if it does not exists
-				if not path.exists(file_path):
-					default_conf = get_default_config_data()
-					for key, value in default_conf.items():
-						save_config_property(f_chat_id, key, value)
+		# Create data directory if it does not exists
+		if not path.exists(CONST["CHATS_DIR"]):
+			makedirs(CONST["CHATS_DIR"])
+		# Get known chats from manifest, or scan chats directory (just once) if there is no manifest
+		chats_ids = load_chats_manifest()
+		if chats_ids is None:
+			chats_ids = scan_chats_ids()
+			chats_manifest_dirty = True
+	# Register known chats, configuration files will be created/read on first access (private
+	# chats with an old full configuration are imported to users state store on first access)
+	with chats_config_files_lock:
+		for chat_id in chats_ids:
+			if get_chat_type(chat_id) == "private":
+				users_legacy_ids.add(chat_id)
+			else:
+				chats_config_files.setdefault(chat_id, None)
+	save_chats_manifest()
+	init_times["chats registry ({} chats)".format(len(chats_ids))] = time() - t0
+	t0 = time()
+	# Load private users state store
+	load_users_state()
+	init_times["users state ({} users)".format(len(users_state))] = time() - t0
+	t0 = time()
 	# Load and generate URL detector regex from TLD list file
 	actual_script_path = path.dirname(path.realpath(__file__))
 	load_urls_regex("{}/{}".format(actual_script_path, CONST["F_TLDS"]))
+	init_times["urls regex"] = time() - t0
+	t0 = time()
 	# Load all languages texts
 	load_texts_languages()
+	init_times["languages"] = time() - t0
+	printts("Startup times: {}".format(", ".join(["{} {:.3f}s".format(step, step_time)
+			for step, step_time in init_times.items()])))
+
+
+def load_chats_manifest():
+	'''Get the list of known chats IDs from manifest file (None if there is no manifest)'''
+	manifest = TSjson(CONST["F_CHATS_MANIFEST"]).read()
+	if not manifest or ("Chats" not in manifest):
+		return None
+	return [int(chat_id) for chat_id in manifest["Chats"]]
+
+
+def save_chats_manifest():
+	'''Write the known chats manifest file if new chats has been registered'''
+	global chats_manifest_dirty
+	if (not chats_manifest_dirty) or (chats_config_db is not None):
+		return
+	chats_manifest_dirty = False
+	chats = OrderedDict([(str(chat_id), get_chat_type(chat_id)) for chat_id in get_chats_ids()])
+	# Keep private chats pending to be imported to users state store
+	for chat_id in list(users_legacy_ids):
+		chats[str(chat_id)] = "private"
+	TSjson(CONST["F_CHATS_MANIFEST"]).write(OrderedDict([("Chats", chats)]))
+
+
+def get_chat_type(chat_id):
+	'''Get chat type from chat ID (Telegram groups and channels IDs are negative)'''
+	if int(chat_id) < 0:
+		return "group"
+	return "private"
+
+
+def start_invite_checker():
+	'''Launch the invite links checker worker'''
+	global invite_checker
+	checker = InviteChecker(SECRETS["API_NAME"], SECRETS["API_ID"], SECRETS["API_HASH"],
+			CONST["INVITE_CHECK_CACHE_TTL"])
+	if checker.start():
+		invite_checker = checker
+		printts("Invite links checker connected.")
+	else:
+		printts("Invite links checker not available, check_invite.py will be used.")
+
+
+def get_chat_dir(chat_id):
+	'''Get chat data directory. With sharded layout it is "<CHATS_DIR>/ab/cd/<chat_id>", where
+	"abcd" are the first characters of chat ID md5 hash (so any directory has few entries)'''
+	if not CONST["CHATS_DIR_SHARDED"]:
+		return "{}/{}".format(CONST["CHATS_DIR"], chat_id)
+	id_hash = hashlib.md5(str(int(chat_id)).encode()).hexdigest()
+	return "{}/{}/{}/{}".format(CONST["CHATS_DIR"], id_hash[0:2], id_hash[2:4], chat_id)
+
+
+def migrate_chat_dir(chat_id):
+	'''Move a chat data directory from flat layout to sharded one (if it was not moved yet), and
+	get the chat data directory'''
+	chat_dir = get_chat_dir(chat_id)
+	flat_chat_dir = "{}/{}".format(CONST["CHATS_DIR"], chat_id)
+	if (chat_dir != flat_chat_dir) and path.exists(flat_chat_dir) and (not path.exists(chat_dir)):
+		try:
+			makedirs(path.dirname(chat_dir), exist_ok=True)
+			os.rename(flat_chat_dir, chat_dir)
+		except Exception as e:
+			printts("Error moving chat {} directory. {}".format(chat_id, str(e)))
+			return flat_chat_dir
+	return chat_dir
+
+
+def scan_chats_ids():
+	'''Get all chats IDs that have a data directory (flat and sharded layouts). Note: Telegram
+	chats IDs are never 2 characters long, so those directories are shards'''
+	chats_ids = []
+	for f_name in listdir(CONST["CHATS_DIR"]):
+		if len(f_name) == 2:
+			shard_dir = "{}/{}".format(CONST["CHATS_DIR"], f_name)
+			for f_subshard in listdir(shard_dir):
+				subshard_dir = "{}/{}".format(shard_dir, f_subshard)
+				chats_ids.extend([int(f_chat_id) for f_chat_id in listdir(subshard_dir)
+						if is_int(f_chat_id)])
+		elif is_int(f_name):
+			chats_ids.append(int(f_name))
+	return chats_ids
 
 
 def load_urls_regex(file_path):
@@ -121,7 +289,8 @@ def load_urls_regex(file_path):
 		printts("Error opening file \"{}\". {}".format(file_path, str(e)))
 	if len(list_file_lines) > 0:
 		tlds_str = "".join(list_file_lines)
-	CONST["REGEX_URLS"] = CONST["REGEX_URLS"].format(tlds_str)
+	# Compile it just once at startup
+	CONST["REGEX_URLS"] = re.compile(CONST["REGEX_URLS"].format(tlds_str))
 
 
 def load_texts_languages():
@@ -274,36 +443,78 @@ def uniq(lst):
 		yield item
 		last = item
 
+# Groups lists, property that enables a group in the list and buttons callback data prefix
+GROUPS_LISTS = OrderedDict([
+	("protected", ("Protected", "p")),
+	("public", ("Public_Notes", "n"))
+])
+
+# Chat properties that change the groups lists
+GROUPS_LISTS_KEYS = frozenset(["Protected", "Public_Notes", "Allowed", "Title"])
+
 def get_protected_list():
-	protected_list = []
-	group_id_list = []
-	for group in files_config_list:
-		if int(group["ID"]) not in group_id_list:
-			enabled = get_chat_config(group["ID"],"Protected")
-			allowed = get_chat_config(group["ID"], "Allowed")
-			title = get_chat_config(group["ID"],"Title")
-			current_user = get_chat_config(group["ID"],"Protection_Current_User")
-			current_time = get_chat_config(group["ID"],"Protection_Current_Time")
-			captcha_timeout = get_chat_config(group["ID"],"Captcha_Time")
-			if enabled and allowed and title:
-				if current_user > 1 and time() > current_time + (captcha_timeout * 60):
-					save_config_property(group["ID"],"Protection_Current_User",0)
-				group_id_list.append(int(group["ID"]))
-				protected_list.append([InlineKeyboardButton(title,callback_data="p{}".format(group["ID"]))])
-	return protected_list
+	return get_groups_list_buttons("protected")
 
 def get_public_list():
-	public_list = []
-	group_id_list = []
-	for group in files_config_list:
-		if int(group["ID"]) not in group_id_list:
-			enabled = get_chat_config(group["ID"],"Public_Notes")
-			allowed = get_chat_config(group["ID"], "Allowed")
-			title = get_chat_config(group["ID"],"Title")
-			if enabled and allowed and title:
-				group_id_list.append(int(group["ID"]))
-				public_list.append([InlineKeyboardButton(title,callback_data="n{}".format(group["ID"]))])
-	return public_list
+	return get_groups_list_buttons("public")
+
+def get_groups_list_buttons(list_name):
+	'''Get the buttons (one per row) of the groups of a list'''
+	with groups_lists_lock:
+		return build_groups_list_buttons(list_name)
+
+def build_groups_list_buttons(list_name):
+	'''Build the buttons (one per row) of the groups of a list.
+	Note: groups_lists_lock must be acquired by the caller'''
+	groups = get_groups_lists()[list_name]
+	prefix = GROUPS_LISTS[list_name][1]
+	return [[InlineKeyboardButton(title,callback_data="{}{}".format(prefix,group_id))]
+			for group_id, title in groups.items()]
+
+def get_groups_list_markup(list_name):
+	'''Get the keyboard of the groups of a list (built once until the list changes)'''
+	with groups_lists_lock:
+		markup = groups_lists_markup.get(list_name)
+		if markup is None:
+			# Built and stored with the lock, so it is not a keyboard of an old list
+			markup = InlineKeyboardMarkup(build_groups_list_buttons(list_name))
+			groups_lists_markup[list_name] = markup
+		return markup
+
+def get_groups_lists():
+	'''Get the protected and public groups lists (ordered dictionaries of group ID to title),
+	build them from all groups configurations on first call.
+	Note: groups_lists_lock must be acquired by the caller'''
+	global groups_lists
+	if groups_lists is None:
+		groups_lists = OrderedDict([(list_name, OrderedDict()) for list_name in GROUPS_LISTS])
+		for group_id in get_chats_ids():
+			if get_chat_type(group_id) == "group":
+				set_groups_lists_group(group_id)
+	return groups_lists
+
+def update_groups_lists(group_id):
+	'''Update the groups lists with actual configuration of a group'''
+	with groups_lists_lock:
+		if groups_lists is not None:
+			set_groups_lists_group(group_id)
+
+def set_groups_lists_group(group_id, removed=False):
+	'''Add, update or remove a group in groups lists (and drop the cached keyboards of modified
+	lists). Note: groups_lists_lock must be acquired by the caller'''
+	group_id = int(group_id)
+	if not removed:
+		allowed = get_chat_config(group_id, "Allowed")
+		title = get_chat_config(group_id,"Title")
+	for list_name, (list_key, _) in GROUPS_LISTS.items():
+		groups = groups_lists[list_name]
+		if (not removed) and allowed and title and get_chat_config(group_id, list_key):
+			if groups.get(group_id) != title:
+				groups[group_id] = title
+				groups_lists_markup.pop(list_name, None)
+		elif group_id in groups:
+			del groups[group_id]
+			groups_lists_markup.pop(list_name, None)
 
 def get_user_full_name(msg):
 	first_name = getattr(msg.from_user, "first_name", "")
@@ -388,21 +599,89 @@ def kick_user(bot,chat_id,user_id,user_name):
 			tlg_send_selfdestruct_msg(bot, chat_id, bot_msg)
 
 def handle_request(bot,chat_id,user_id,captcha_timeout, lang):
-	link = revoke_group_link(bot,chat_id)
-	if len(link) > 1:
-		user_time = time()
-		save_config_property(chat_id,"Protection_Current_User",user_id)
-		save_config_property(chat_id,"Protection_Current_Time",user_time)
-		return TEXT[lang]["PROTECTION_SEND_LINK"].format(link,captcha_timeout)
-		#Timer(int(captcha_timeout), revoke_group_link_delayed, [bot,chat_id,user_id,user_time]).start()
-	else:
-		return TEXT[lang]["PROTECTION_NO_LINK"]
-		
+	'''Send the group invite link to a user that has a reserved place in the group admission
+	queue, and set his deadline to join'''
+	# Get the link with the group link lock, so a concurrent request does not revoke it
+	with get_protection_link_lock(chat_id):
+		with protection_pending_lock:
+			other_pending = len(get_pending_users(chat_id)) > 1
+		current_hash = get_chat_config(chat_id, "Invite_Hash")
+		if other_pending and (len(current_hash) > 1):
+			# There are other pending users, share their link (a new one would revoke it)
+			link = CONST["INVITE_LINK_PREFIX"].format(current_hash)
+		else:
+			# Use the pre-generated link of the group (or get one now if there is not a ready one)
+			link = take_pool_invite_link(chat_id)
+			if link is None:
+				link = revoke_group_link(bot,chat_id)
+	with protection_pending_lock:
+		pending = get_pending_users(chat_id)
+		if len(link) > 1:
+			pending[user_id] = time() + (captcha_timeout * 60)
+			save_pending_users(chat_id, pending)
+			return TEXT[lang]["PROTECTION_SEND_LINK"].format(link,captcha_timeout)
+		pending.pop(user_id, None)
+		save_pending_users(chat_id, pending)
+	return TEXT[lang]["PROTECTION_NO_LINK"]
+
+
+def get_protection_link_lock(chat_id):
+	'''Get the lock that serializes getting and generating the invite link of a protected group
+	(same lock for the same ID, shared by some groups)'''
+	return protection_link_locks[int(chat_id) % len(protection_link_locks)]
+
+
+def get_pending_users(chat_id):
+	'''Get the admission queue of a protected group (ordered dictionary of users IDs to deadline
+	to join), load it from chat state if it is not loaded, and remove expired users.
+	Note: protection_pending_lock must be acquired by the caller'''
+	chat_id = int(chat_id)
+	pending = protection_pending.get(chat_id)
+	if pending is None:
+		pending = OrderedDict([(user_id, deadline) for user_id, deadline in
+				get_chat_config(chat_id, "Protection_Pending")])
+		protection_pending[chat_id] = pending
+	now = time()
+	expired = [user_id for user_id, deadline in pending.items() if deadline < now]
+	if expired:
+		for user_id in expired:
+			del pending[user_id]
+		save_pending_users(chat_id, pending)
+	return pending
+
+
+def save_pending_users(chat_id, pending):
+	'''Store the admission queue of a protected group in chat state'''
+	save_config_property(chat_id, "Protection_Pending",
+			[[user_id, deadline] for user_id, deadline in pending.items()])
+
+
+def admit_pending_user(chat_id, user_id):
+	'''Remove a joined user from group admission queue. Return True if he was in the queue'''
+	with protection_pending_lock:
+		pending = get_pending_users(chat_id)
+		if user_id not in pending:
+			return False
+		del pending[user_id]
+		save_pending_users(chat_id, pending)
+	return True
+
+
+def expire_pending_users():
+	'''Remove users whose time to join has ended from all loaded admission queues'''
+	with protection_pending_lock:
+		for chat_id in list(protection_pending.keys()):
+			get_pending_users(chat_id)
+
+
+def has_pending_users(chat_id):
+	'''Check if there is any user waiting to join a protected group'''
+	with protection_pending_lock:
+		return len(get_pending_users(chat_id)) > 0
 
 def revoke_group_link_delayed(bot,chat_id, expected_user, expected_time):
-	if expected_user == get_chat_config(chat_id,"Protection_Current_User"):
-		if expected_time == get_chat_config(chat_id,"Protection_Current_Time"):
-			return bot.exportChatInviteLink(chat_id)
+	if not has_pending_users(chat_id):
+		return bot.exportChatInviteLink(chat_id)
 
 def revoke_group_link(bot,chat_id):
 	current_hash = get_chat_config(chat_id, "Invite_Hash")
@@ -412,11 +691,15 @@ def revoke_group_link(bot,chat_id):
 	else:
 		try:
 			invite_link = bot.exportChatInviteLink(chat_id)
+			# Exporting a new link revokes the previous one
+			discard_pool_invite_link(chat_id)
+			if invite_checker is not None:
+				invite_checker.invalidate(current_hash)
 			new_hash = invite_link.split("/")
 			new_hash=new_hash[len(new_hash)-1]
 			if tlg_check_invite_hash(new_hash):
-				save_config_property(chat_id,"Invite_Hash",new_hash)
-				save_config_property(chat_id,"Invite_Hash_time",time())
+				save_config_properties(chat_id, {"Invite_Hash": new_hash,
+						"Invite_Hash_time": time()})
 				return invite_link
 			else:
 				if tlg_check_invite_hash(current_hash):
@@ -425,30 +708,128 @@ def revoke_group_link(bot,chat_id):
 			pass#handle no rights to revoke link
 	return ""
 
+def take_pool_invite_link(chat_id):
+	'''Get the ready invite link of a group from the invite links pool (None if there is not a
+	fresh one). The link is marked as used, so it is not given again'''
+	with invite_links_pool_lock:
+		pool_link = invite_links_pool.get(int(chat_id))
+		if (pool_link is None) or pool_link["used"] or \
+				(time() > pool_link["time"] + CONST["MAX_INVITE_LINK_AGE"]):
+			return None
+		pool_link["used"] = True
+		return pool_link["link"]
+
+
+def note_invite_link_demand(chat_id):
+	'''Store the time of the last invite link request of a group (just groups with recent requests
+	get pre-generated links)'''
+	with invite_links_pool_lock:
+		invite_links_demand[int(chat_id)] = time()
+
+
+def discard_pool_invite_link(chat_id):
+	'''Remove the invite link of a group from the invite links pool (it will be replaced)'''
+	with invite_links_pool_lock:
+		invite_links_pool.pop(int(chat_id), None)
+
+
+def refill_pool_invite_link(bot,chat_id):
+	'''Generate a new invite link for a group (it revokes the previous one), validate it and add
+	it to the invite links pool'''
+	with get_protection_link_lock(chat_id):
+		# The link could have been given since the check
+		if not pool_invite_link_expired(chat_id, time()):
+			return False
+		old_hash = get_chat_config(chat_id, "Invite_Hash")
+		try:
+			invite_link = bot.exportChatInviteLink(chat_id)
+		except Exception as e:
+			printts("[{}] {}".format(chat_id, str(e)))
+			return False
+		if invite_checker is not None:
+			invite_checker.invalidate(old_hash)
+		new_hash = invite_link.split("/")[-1]
+		if not tlg_check_invite_hash(new_hash):
+			return False
+		link_time = time()
+		save_config_properties(chat_id, {"Invite_Hash": new_hash, "Invite_Hash_time": link_time})
+		with invite_links_pool_lock:
+			invite_links_pool[int(chat_id)] = {"link": invite_link, "time": link_time,
+					"used": False}
+	return True
+
+
+def pool_invite_link_expired(chat_id, now):
+	'''Check if the invite link of a group in the pool must be replaced: it is too old and it has
+	not been given, or it was given (or there is no pool link) and all pending users have joined
+	or their time has ended'''
+	with invite_links_pool_lock:
+		pool_link = invite_links_pool.get(chat_id)
+		if pool_link is None:
+			# Without a pool link, pending users could have the group current link (a new one
+			# would revoke it)
+			return not has_pending_users(chat_id)
+		link_used = pool_link["used"]
+		link_time = pool_link["time"]
+	if not link_used:
+		return now > link_time + CONST["MAX_INVITE_LINK_AGE"]
+	return not has_pending_users(chat_id)
+
+
+def invite_links_maintainer(bot):
+	'''Background thread that keeps a fresh and validated invite link ready for each protected
+	group with recent link requests (idle groups do not get links generated forever). Links are
+	generated in small rounds (oldest first), so Telegram API is not flooded'''
+	while True:
+		try:
+			now = time()
+			# Allowed protected groups are already indexed in protected groups list
+			with groups_lists_lock:
+				protected_ids = set(get_groups_lists()["protected"].keys())
+			# Forget old requests, and get the groups with recent ones
+			with invite_links_pool_lock:
+				demand_time = now - CONST["INVITE_LINKS_POOL_DEMAND_TTL"]
+				for group_id in [group_id for group_id, request_time in invite_links_demand.items()
+						if request_time < demand_time]:
+					del invite_links_demand[group_id]
+					invite_links_pool.pop(group_id, None)
+				demanded_ids = [group_id for group_id in invite_links_demand
+						if group_id in protected_ids]
+			to_refill = [group_id for group_id in demanded_ids
+					if pool_invite_link_expired(group_id, now)]
+			with invite_links_pool_lock:
+				to_refill.sort(key=lambda group_id: invite_links_pool.get(group_id, {"time": 0})["time"])
+			for group_id in to_refill[:CONST["INVITE_LINKS_POOL_MAX_REFILLS"]]:
+				refill_pool_invite_link(bot, group_id)
+				sleep(CONST["INVITE_LINKS_POOL_REFILL_DELAY"])
+		except Exception as e:
+			printts("Error generating invite links. {}".format(str(e)))
+		sleep(CONST["INVITE_LINKS_POOL_INTERVAL"])
+
+
 def request_group_link(bot,chat_id,user_id,lang,query_id):
 	printts("[{}]: user {} requested group link".format(chat_id,user_id))
-	current_user = get_chat_config(chat_id,"Protection_Current_User")
-	current_user_time = get_chat_config(chat_id,"Protection_Current_Time")
+	note_invite_link_demand(chat_id)
 	captcha_timeout = get_chat_config(chat_id,"Captcha_Time")
-	if ((current_user == "" or current_user == 0) and time() > current_user_time+60):
-		printts("[{}]: user {} no old active link, requesting new one.".format(chat_id,user_id))
-		bot_msg = handle_request(bot,chat_id,user_id,captcha_timeout, lang)
-		
-	elif current_user != user_id:
-		if time() > current_user_time+(captcha_timeout*60):
-			printts("[{}]: user {} old link timed out, requesting new".format(chat_id,user_id))
-			bot_msg = handle_request(bot,chat_id,user_id,captcha_timeout, lang)
-		else:
-			mins_left = math.floor((current_user_time+(captcha_timeout*60)-time())/60)
+	reserved = False
+	with protection_pending_lock:
+		pending = get_pending_users(chat_id)
+		if user_id in pending:
+			bot_msg = TEXT[lang]["PROTECTION_REQUESTED"]
+		elif len(pending) >= CONST["PROTECTION_MAX_PENDING"]:
+			# Admission queue is full, wait for the first user deadline
+			mins_left = math.floor((next(iter(pending.values()))-time())/60)
 			if mins_left <=0:
 				mins_left = 1
-			printts("[{}]: user {} old link still active".format(chat_id,user_id))
+			printts("[{}]: user {} admission queue is full".format(chat_id,user_id))
 			bot_msg = TEXT[lang]["PROTECTION_IN_PROCESS"].format(mins_left)
-	elif time() > current_user_time+(captcha_timeout*60):
-		printts("[{}]: user {} old link timed out, requesting new".format(chat_id,user_id))
+		else:
+			# Reserve a place in admission queue while the link is got
+			pending[user_id] = time() + (captcha_timeout * 60)
+			reserved = True
+	if reserved:
+		printts("[{}]: user {} added to admission queue, sending link.".format(chat_id,user_id))
 		bot_msg = handle_request(bot,chat_id,user_id,captcha_timeout, lang)
-	else:
-		bot_msg = TEXT[lang]["PROTECTION_REQUESTED"]
 	bot.send_message(user_id, bot_msg,parse_mode=ParseMode.HTML)
 	bot.answer_callback_query(query_id)
 
@@ -462,11 +843,50 @@ def set_public_group(bot,group_id,user_id,lang,query_id):
 	bot.answer_callback_query(query_id)
 
 def list_admin_groups(bot,user_id):
-	admin_list = []
-	for group in files_config_list:
-		if group["ID"] not in admin_list and tlg_user_is_admin(bot, user_id, group["ID"]):
-			admin_list.append(group["ID"])
-	return admin_list
+	'''Get the groups where the user is an Administrator, from the user to administered groups
+	index. Groups without recent Administrators are requested in parallel, waiting for them just
+	ADMINS_GROUPS_INDEX_TIMEOUT seconds (the requests continue in background)'''
+	groups_ids = [group_id for group_id in get_chats_ids() if get_chat_type(group_id) == "group"]
+	to_request = get_admins_index_stale_groups(groups_ids, CONST["ADMINS_GROUPS_INDEX_TTL"])
+	if to_request:
+		wait([admins_executor.submit(tlg_get_chat_admins, bot, group_id,
+				CONST["ADMINS_GROUPS_INDEX_TTL"]) for group_id in to_request],
+				timeout=CONST["ADMINS_GROUPS_INDEX_TIMEOUT"])
+	with chats_admins_lock:
+		user_groups = admins_groups.get(user_id, set())
+		return [group_id for group_id in groups_ids if group_id in user_groups]
+
+
+def get_admins_index_stale_groups(groups_ids, max_age):
+	'''Get the groups without Administrators got in the last max_age seconds (ignoring groups
+	whose last request failed in the last ADMINS_GROUPS_INDEX_FAILED_TTL seconds)'''
+	failed_ttl = CONST["ADMINS_GROUPS_INDEX_FAILED_TTL"]
+	with chats_admins_lock:
+		now = time()
+		return [group_id for group_id in groups_ids
+				if ((group_id not in chats_admins) or (now - chats_admins[group_id][1] >= max_age))
+				and (now - chats_admins_failed.get(group_id, 0) >= failed_ttl)]
+
+
+def admins_index_warmer(bot):
+	'''Background thread that keeps the user to administered groups index updated, so listing the
+	groups of an Administrator does not need to wait for Telegram requests. Groups are requested
+	in small batches to not flood Telegram API'''
+	while True:
+		try:
+			groups_ids = [group_id for group_id in get_chats_ids()
+					if get_chat_type(group_id) == "group"]
+			# Update Administrators at half index TTL, so they are not expired when listed
+			max_age = CONST["ADMINS_GROUPS_INDEX_TTL"] / 2
+			to_request = get_admins_index_stale_groups(groups_ids, max_age)
+			batch = CONST["ADMINS_FETCH_WORKERS"]
+			for i in range(0, len(to_request), batch):
+				list(admins_executor.map(lambda group_id: tlg_get_chat_admins(bot, group_id,
+						max_age), to_request[i:i+batch]))
+				sleep(1)
+		except Exception as e:
+			printts("Error updating Administrators groups index. {}".format(str(e)))
+		sleep(CONST["ADMINS_GROUPS_INDEX_TTL"] / 4)
 
 
 def get_connected_group(bot,user_id):
@@ -514,30 +934,127 @@ def is_owner(id):
 	return int(id) == int(SECRETS["OWNER"])
 
 def is_muted(chat_id,user_id):
-	new_list = get_chat_config(chat_id,"Muted_List")
-	for user in get_chat_config(chat_id,"Muted_List"):
-		if user["id"] == user_id:
-			if user["time"] > time():
-				return True
-			else:
-				new_list.remove(user)
-				return False
-	save_config_property(chat_id,"Muted_List",new_list)
-	return False
-
-def delete_from_muted_list(muted_list,user_id):
-	new_list = []
-	for user in muted_list:
-		if not user["id"] == user_id:
-			new_list.append(user)
-	return new_list
+	'''Check if a user is muted in a chat (in-memory lookup)'''
+	with muted_users_lock:
+		mute_time = get_muted_users(chat_id).get(int(user_id))
+	return (mute_time is not None) and (mute_time > time())
+
+
+def mute_user(chat_id,user_id,mute_time):
+	'''Add a user to chat muted users until the given time'''
+	chat_id = int(chat_id)
+	user_id = int(user_id)
+	with muted_users_lock:
+		get_muted_users(chat_id)[user_id] = mute_time
+		push_mute_expiry(mute_time, chat_id, user_id)
+		muted_users_dirty.add(chat_id)
+
+
+def unmute_user(chat_id,user_id):
+	'''Remove a user from chat muted users'''
+	chat_id = int(chat_id)
+	with muted_users_lock:
+		if get_muted_users(chat_id).pop(int(user_id), None) is not None:
+			muted_users_dirty.add(chat_id)
+
+
+def get_muted_users(chat_id):
+	'''Get the muted users (user ID to mute end time) of a chat, load them from chat Muted_List
+	if they are not loaded. Note: muted_users_lock must be acquired by the caller'''
+	chat_id = int(chat_id)
+	drop_stale_muted_users()
+	chat_muted = muted_users.get(chat_id)
+	if chat_muted is None:
+		chat_muted = {}
+		if get_chat_type(chat_id) == "private":
+			return chat_muted
+		now = time()
+		muted_list = get_chat_config(chat_id,"Muted_List")
+		muted_users[chat_id] = chat_muted
+		for user in muted_list:
+			if user["time"] > now:
+				chat_muted[user["id"]] = user["time"]
+				push_mute_expiry(user["time"], chat_id, user["id"])
+			else:
+				muted_users_dirty.add(chat_id)
+	return chat_muted
+
+
+def drop_stale_muted_users():
+	'''Drop the muted users of chats whose configuration file has been modified externally (they
+	are loaded again from the file). Note: muted_users_lock must be acquired by the caller'''
+	while muted_users_stale:
+		chat_id = muted_users_stale.pop()
+		muted_users.pop(chat_id, None)
+		muted_users_dirty.discard(chat_id)
+
+
+def drop_chat_users_lists(chat_id):
+	'''Drop in-memory muted and beginner users of a chat, its configuration file has been modified
+	externally. Muted users are dropped by the next muted_users_lock holder (this can be called
+	while muted_users_lock is held, loading a chat muted users)'''
+	beginner_users.pop(int(chat_id), None)
+	muted_users_stale.add(int(chat_id))
+
+
+def push_mute_expiry(mute_time, chat_id, user_id):
+	'''Add a mute end time to the expiry min-heap (permanent mutes never expire, so they are not
+	added). The heap is rebuilt without old entries (unmuted or muted again users) when it grows
+	too much. Note: muted_users_lock must be acquired by the caller'''
+	global muted_users_expiry_limit
+	if mute_time >= FOREVER:
+		return
+	heappush(muted_users_expiry, (mute_time, chat_id, user_id))
+	if len(muted_users_expiry) > muted_users_expiry_limit:
+		muted_users_expiry[:] = [(user_time, chat, user)
+				for chat, chat_muted in muted_users.items()
+				for user, user_time in chat_muted.items() if user_time < FOREVER]
+		heapify(muted_users_expiry)
+		muted_users_expiry_limit = max(1024, 2*len(muted_users_expiry))
+
+
+def expire_muted_users():
+	'''Remove all users whose mute time has ended (in order of end time, using a min-heap)'''
+	now = time()
+	with muted_users_lock:
+		while muted_users_expiry and (muted_users_expiry[0][0] <= now):
+			mute_time, chat_id, user_id = heappop(muted_users_expiry)
+			chat_muted = muted_users.get(chat_id)
+			# Ignore old entries of users that has been unmuted or muted again
+			if (chat_muted is not None) and (chat_muted.get(user_id) == mute_time):
+				del chat_muted[user_id]
+				muted_users_dirty.add(chat_id)
+
+
+def save_muted_users():
+	'''Store in chats Muted_List the muted users of chats modified since last call (a Muted_List
+	modified externally is loaded instead of overwriting it)'''
+	with muted_users_lock:
+		dirty_ids = list(muted_users_dirty)
+	# Check if the chats files have been modified (without muted_users_lock, it loads the files)
+	for chat_id in dirty_ids:
+		get_chat_config(chat_id, "Muted_List")
+	with muted_users_lock:
+		drop_stale_muted_users()
+		to_save = []
+		for chat_id in muted_users_dirty:
+			chat_muted = muted_users.get(chat_id, {})
+			to_save.append((chat_id, [{"id": user_id, "time": mute_time}
+					for user_id, mute_time in chat_muted.items()]))
+		muted_users_dirty.clear()
+	for chat_id, muted_list in to_save:
+		save_config_property(chat_id,"Muted_List",muted_list)
 
 
 def is_beginner(chat_id,user_id):
-	for user in get_chat_config(chat_id,"Beginner_List"):
-		if user["id"] == user_id:
-			return True
-	return False
+	'''Check if a user is in chat beginners list (in-memory lookup)'''
+	chat_id = int(chat_id)
+	chat_beginners = beginner_users.get(chat_id)
+	if chat_beginners is None:
+		chat_beginners = frozenset([user["id"] for user in
+				get_chat_config(chat_id,"Beginner_List")])
+		beginner_users[chat_id] = chat_beginners
+	return int(user_id) in chat_beginners
 
 def delete_if_muted(bot,update):
 	msg = update.message
@@ -599,9 +1116,8 @@ def message_to_html(og_text,entities,cmd_offset=0):
 
 ### JSON chat config file functions ###
 
-def get_default_config_data():
-	'''Get default config data structure'''
-	config_data = OrderedDict(
+# Default chat configuration (read-only, use get_default_config_data() to get a modifiable copy)
+DEFAULT_CONFIG_DATA = MappingProxyType(OrderedDict(
 	[
 		("Title", CONST["INIT_TITLE"]),
 		("Link", CONST["INIT_LINK"]),
@@ -612,23 +1128,15 @@ def get_default_config_data():
 		("Captcha_Chars_Mode", CONST["INIT_CAPTCHA_CHARS_MODE"]),
 		("Language", CONST["INIT_LANG"]),
 		("Welcome_Msg", CONST["INIT_WELCOME_MSG"]),
-		("Last_User_Solve", 0),
-		("User_Solve_Result", "0"),
 		("Delete_Welcome", True),
 		("Delete_Notes", True),
 		("Ignore_List", []),
 		("Allowed",False),
 		("Protected",False),
-		("Protection_Current_User",0),
-		("Protection_Current_Time",0),
 		("Connected_Group",0),
 		("Trigger_List", {}),
 		("Question_List", {}),
 		("Trigger_Char", CONST["INIT_TRIGGER_CHAR"]),
-		("Last_Welcome_Msg", [0,0]),
-		("Invite_Hash", ""),
-		("Invite_Hash_time", 0),
-		("Muted_List", []),
 		("Beginner_List", []),
 		("Mute_Time", 3600),
 		("Public_Notes", False),
@@ -636,84 +1144,741 @@ def get_default_config_data():
 		("Allow_Bots", False),
 		("Filters_Enabled",False),
 		("Filter_List", {}),
-		("Delete_Info", False)
-	])
-	return config_data
+		("Delete_Info", False),
+		("Schema_Version", CONST["CONFIG_SCHEMA_VERSION"])
+	]))
+
+# Default chat runtime state (hot properties that change constantly, stored apart from the
+# chat configuration)
+DEFAULT_STATE_DATA = MappingProxyType(OrderedDict(
+	[
+		("Last_User_Solve", 0),
+		("User_Solve_Result", "0"),
+		("Protection_Pending", []),
+		("Last_Welcome_Msg", [0,0]),
+		("Invite_Hash", ""),
+		("Invite_Hash_time", 0),
+		("Muted_List", [])
+	]))
+
+# Chat state properties
+CHAT_STATE_KEYS = frozenset(DEFAULT_STATE_DATA.keys())
+
+# Chat configuration migrations, list of (version, function) that upgrade a configuration from
+# previous version to the specified one
+CONFIG_MIGRATIONS = []
+
+
+def migrate_config_split_state(chat_id, config_data):
+	'''Schema v2: Move runtime state properties from chat configuration to chat state'''
+	legacy_state = OrderedDict()
+	# Chat state properties of schema v2
+	for key in ("Last_User_Solve", "User_Solve_Result", "Protection_Current_User",
+			"Protection_Current_Time", "Last_Welcome_Msg", "Invite_Hash", "Invite_Hash_time",
+			"Muted_List"):
+		if key in config_data:
+			legacy_state[key] = config_data.pop(key)
+	if legacy_state:
+		fjson_state = get_chat_config_file(chat_id, "state")
+		state_data = fjson_state.read() or OrderedDict()
+		state_data.update(legacy_state)
+		fjson_state.write(state_data)
+
+CONFIG_MIGRATIONS.append((2, migrate_config_split_state))
+
+
+def migrate_config_protection_queue(chat_id, config_data):
+	'''Schema v3: Replace the protection single user slot with the admission queue'''
+	fjson_state = get_chat_config_file(chat_id, "state")
+	state_data = fjson_state.read()
+	if not state_data or ("Protection_Current_User" not in state_data):
+		return
+	current_user = state_data.pop("Protection_Current_User")
+	current_time = state_data.pop("Protection_Current_Time", 0)
+	captcha_timeout = config_data.get("Captcha_Time", CONST["INIT_CAPTCHA_TIME_MIN"])
+	if current_user:
+		state_data["Protection_Pending"] = [[current_user, current_time + (captcha_timeout * 60)]]
+	fjson_state.write(state_data)
+
+CONFIG_MIGRATIONS.append((3, migrate_config_protection_queue))
+
+
+def get_default_config_data(document="config"):
+	'''Get default config (or state) data structure'''
+	if document == "state":
+		return deepcopy(OrderedDict(DEFAULT_STATE_DATA))
+	return deepcopy(OrderedDict(DEFAULT_CONFIG_DATA))
+
+
+def get_config_document(property):
+	'''Get the document ("config" or "state") where a chat property is stored'''
+	if property in CHAT_STATE_KEYS:
+		return "state"
+	return "config"
+
+
+def is_write_behind(document):
+	'''Check if changes of the given document are written later by the flusher thread'''
+	if document == "state":
+		return CONST["STATE_WRITE_BEHIND"]
+	return CONST["CONFIG_WRITE_BEHIND"]
+
+
+def migrate_config_data(chat_id, config_data):
+	'''Upgrade a chat configuration to actual schema version and add any missing property with
+	its default value (also for actual version, files could be modified externally or restored
+	from an old backup). Return True if it was modified'''
+	modified = False
+	version = config_data.get("Schema_Version", 0)
+	if version < CONST["CONFIG_SCHEMA_VERSION"]:
+		for migration_version, migration in CONFIG_MIGRATIONS:
+			if version < migration_version <= CONST["CONFIG_SCHEMA_VERSION"]:
+				migration(chat_id, config_data)
+		config_data["Schema_Version"] = CONST["CONFIG_SCHEMA_VERSION"]
+		modified = True
+	# Add any missing property with its default value
+	for key, value in DEFAULT_CONFIG_DATA.items():
+		if key not in config_data:
+			config_data[key] = deepcopy(value)
+			modified = True
+	return modified
 
 
 def save_config_property(chat_id, property, value):
-	'''Store actual chat configuration in file'''
-	fjson_config = get_chat_config_file(chat_id)
-	config_data = fjson_config.read()
-	if not config_data:
-		config_data = get_default_config_data()
-	config_data[property] = value
-	fjson_config.write(config_data)
+	'''Store actual chat configuration in memory cache and file (write-through)'''
+	save_config_properties(chat_id, {property: value})
+
+
+def save_config_properties(chat_id, properties):
+	'''Store several chat configuration properties at once (just one write per document)'''
+	# Private chats just have a few properties in users state store
+	if get_chat_type(chat_id) == "private":
+		save_user_state(chat_id, properties)
+		return
+	with get_chat_update_lock(chat_id):
+		documents_changes = OrderedDict()
+		for property, value in properties.items():
+			document = get_config_document(property)
+			config_data = get_cached_config_data(chat_id, document)
+			# Avoid rewriting the file if the property has not changed
+			if (property in config_data) and (config_data[property] == value):
+				continue
+			config_data[property] = deepcopy(value)
+			documents_changes.setdefault(document, OrderedDict())[property] = value
+		lists_changed = ("config" in documents_changes) and \
+				not GROUPS_LISTS_KEYS.isdisjoint(documents_changes["config"])
+		for document, changes in documents_changes.items():
+			config_data = get_cached_config_data(chat_id, document)
+			if is_write_behind(document):
+				# Mark the chat document as dirty, the flusher thread will write it later (it is
+				# added again to the cache in case other thread has dropped it meanwhile)
+				cache_key = (int(chat_id), document)
+				with chats_config_cache_lock:
+					chats_config_cache[cache_key] = config_data
+					chats_config_dirty.setdefault(cache_key, OrderedDict()).update(changes)
+			else:
+				get_chat_config_file(chat_id, document).write(config_data, changes)
+	# Keep protected and public groups lists updated
+	if lists_changed:
+		update_groups_lists(chat_id)
 
 
 def get_chat_config(chat_id, param):
 	'''Get specific stored chat configuration property'''
-	file = get_chat_config_file(chat_id)
-	if file:
-		config_data = file.read()
-		if not config_data:
-			config_data = get_default_config_data()
-			save_config_property(chat_id, param, config_data[param])
-		if param not in config_data:
-			config_data[param] = get_default_config_data()[param]
-			save_config_property(chat_id,param,config_data[param])
-	else:
-		config_data = get_default_config_data()
-		save_config_property(chat_id, param, config_data[param])
-	return config_data[param]
-
-
-def get_chat_config_file(chat_id):
-	'''Determine chat config file from the list by ID. Get the file if exists or create it if not'''
-	global files_config_list
-	file = OrderedDict([("ID", chat_id), ("File", None)])
-	found = False
-	if files_config_list:
-		for chat_file in files_config_list:
-			if chat_file["ID"] == chat_id:
-				file = chat_file
-				found = True
-				break
-		if not found:
-			chat_config_file_name = "{}/{}/{}".format(CONST["CHATS_DIR"], chat_id, CONST["F_CONF"])
-			file["ID"] = chat_id
-			file["File"] = TSjson(chat_config_file_name)
-			files_config_list.append(file)
+	# Private chats just have a few properties in users state store
+	if get_chat_type(chat_id) == "private":
+		return get_user_state(chat_id, param)
+	document = get_config_document(param)
+	update_lock = get_chat_update_lock(chat_id)
+	# Cached configurations are read with the lock in shared mode (concurrent readers), it is
+	# just acquired in exclusive mode to load the configuration from file
+	update_lock.acquire_read()
+	try:
+		config_data = get_cached_config_hit(chat_id, document)
+		if config_data is not None:
+			value = copy_config_value(config_data[param])
+	finally:
+		update_lock.release_read()
+	if config_data is None:
+		with update_lock:
+			value = copy_config_value(get_cached_config_data(chat_id, document)[param])
+	return value
+
+
+def copy_config_value(value):
+	'''Get a copy of mutable values to avoid callers modifying the cached configuration'''
+	if isinstance(value, (list, dict)):
+		return deepcopy(value)
+	return value
+
+
+def get_cached_config_hit(chat_id, document="config"):
+	'''Get chat configuration (or state) data from memory cache, None if it is not cached or the
+	file has been modified externally (and there are no pending changes), so it must be loaded.
+	Note: The chat update lock must be acquired by the caller (shared mode is enough)'''
+	cache_key = (int(chat_id), document)
+	with chats_config_cache_lock:
+		config_data = chats_config_cache.get(cache_key)
+		dirty = cache_key in chats_config_dirty
+	if config_data is None:
+		return None
+	if CONST["CONFIG_CACHE_CHECK_FILE"] and (not dirty) and \
+			get_chat_config_file(chat_id, document).changed():
+		return None
+	# Mark as most recently used
+	with chats_config_cache_lock:
+		if cache_key in chats_config_cache:
+			chats_config_cache.move_to_end(cache_key)
+	return config_data
+
+
+def get_cached_config_data(chat_id, document="config"):
+	'''Get chat configuration (or state) data from memory cache, load it from file if it is not
+	cached. Note: The chat update lock must be acquired in exclusive mode by the caller
+	(chats_config_cache_lock is just held to access the cache, never while reading or writing
+	files)'''
+	config_data = get_cached_config_hit(chat_id, document)
+	if config_data is not None:
+		return config_data
+	cache_key = (int(chat_id), document)
+	fjson_config = get_chat_config_file(chat_id, document)
+	# A cached configuration that must be loaded has been modified externally
+	with chats_config_cache_lock:
+		reloaded = cache_key in chats_config_cache
+	if reloaded:
+		drop_chat_users_lists(chat_id)
+	# Chat configuration must be loaded (and migrated) before its state
+	if document == "state":
+		get_cached_config_data(chat_id, "config")
+	config_data = fjson_config.read()
+	if not config_data:
+		config_data = get_default_config_data(document)
+	elif document == "state":
+		for key, value in DEFAULT_STATE_DATA.items():
+			if key not in config_data:
+				config_data[key] = deepcopy(value)
+	elif migrate_config_data(chat_id, config_data):
+		# Store the upgraded configuration, so it is migrated just once
+		fjson_config.write(config_data)
+	with chats_config_cache_lock:
+		chats_config_cache[cache_key] = config_data
+		drop_config_cache_entries(cache_key)
+	return config_data
+
+
+def drop_config_cache_entries(keep_cache_key):
+	'''Drop least recently used chats configurations if cache is full. Configurations with pending
+	changes are kept (just the flusher thread writes them). Return the dropped cache keys.
+	Note: chats_config_cache_lock must be acquired by the caller'''
+	num_to_drop = len(chats_config_cache) - CONST["CONFIG_CACHE_MAX_CHATS"]
+	dropped = []
+	if num_to_drop <= 0:
+		return dropped
+	for cache_key in chats_config_cache:
+		if len(dropped) >= num_to_drop:
+			break
+		if (cache_key != keep_cache_key) and (cache_key not in chats_config_dirty):
+			dropped.append(cache_key)
+	for cache_key in dropped:
+		del chats_config_cache[cache_key]
+	return dropped
+
+
+def flush_config_changes():
+	'''Write to disk all chats configurations modified since last flush (write-behind)'''
+	with chats_config_flush_lock:
+		with chats_config_cache_lock:
+			dirty_keys = list(chats_config_dirty.keys())
+		# Write each chat holding its update lock, so the data can not be modified or reloaded
+		# from file while it is written
+		for cache_key in dirty_keys:
+			with get_chat_update_lock(cache_key[0]):
+				with chats_config_cache_lock:
+					changes = chats_config_dirty.pop(cache_key, None)
+					config_data = chats_config_cache.get(cache_key)
+				if changes and (config_data is not None):
+					get_chat_config_file(*cache_key).write(config_data, changes)
+
+
+def config_flusher():
+	'''Background thread that periodically writes modified chats configurations'''
+	while True:
+		sleep(CONST["CONFIG_FLUSH_INTERVAL"])
+		try:
+			flush_config_changes()
+		except Exception as e:
+			printts("Error writing chats configurations. {}".format(str(e)))
+
+
+def get_chat_config_file(chat_id, document="config"):
+	'''Determine chat config (or state) file from the registry by ID. Get the file if exists or
+	create it if not'''
+	global chats_config_files
+	global chats_manifest_dirty
+	chat_id = int(chat_id)
+	chat_files = chats_config_files.get(chat_id)
+	if chat_files is None:
+		with chats_config_files_lock:
+			# Check again, other thread could have registered it while waiting the lock
+			chat_files = chats_config_files.get(chat_id)
+			if chat_files is None:
+				# New chat, add it to the known chats manifest
+				if chat_id not in chats_config_files:
+					chats_manifest_dirty = True
+				chat_lock = get_chat_lock(chat_id)
+				if chats_config_db is not None:
+					chat_files = OrderedDict([
+						("config", chats_config_db.get_chat_file(chat_id, chat_lock)),
+						("state", chats_state_db.get_chat_file(chat_id, chat_lock))
+					])
+				else:
+					chat_dir = migrate_chat_dir(chat_id)
+					chat_files = OrderedDict([
+						("config", TSjson("{}/{}".format(chat_dir, CONST["F_CONF"]),
+								CONST["CONFIG_JOURNAL"], CONST["CONFIG_CODEC"], chat_lock,
+								cache=False)),
+						("state", TSjson("{}/{}".format(chat_dir, CONST["F_STATE"]),
+								False, CONST["CONFIG_CODEC"], chat_lock, cache=False))
+					])
+				chats_config_files[chat_id] = chat_files
+	return chat_files[document]
+
+
+def get_chat_update_lock(chat_id):
+	'''Get the readers-writer lock that serializes load, modify and write of a chat configuration
+	(shared mode for cached reads). Same lock for the same ID, shared by some chats'''
+	return chats_config_update_locks[int(chat_id) % len(chats_config_update_locks)]
+
+
+def get_chat_lock(chat_id):
+	'''Get the readers-writer lock of a chat (same lock for the same ID, shared by some chats)'''
+	return chats_config_locks[int(chat_id) % len(chats_config_locks)]
+
+
+def sync_config_journals(compact=False):
+	'''Flush to disk (one fsync per file) all chats configuration journals written since last
+	call, and compact into the configuration file the ones that have grown too much'''
+	if (not CONST["CONFIG_JOURNAL"]) or (chats_config_db is not None):
+		return
+	for chat_id in get_chats_ids():
+		chat_files = chats_config_files.get(chat_id)
+		if chat_files is None:
+			continue
+		fjson_config = chat_files["config"]
+		if compact or (fjson_config.journal_entries >= CONST["CONFIG_JOURNAL_MAX_ENTRIES"]):
+			fjson_config.compact()
+		else:
+			fjson_config.sync()
+
+
+def get_chats_ids():
+	'''Get a snapshot list of all registered chats IDs'''
+	with chats_config_files_lock:
+		return list(chats_config_files.keys())
+
+####################################################################################################
+
+### Private users state store functions ###
+
+# Properties stored for private chats (any other property has its default value if it has not
+# been set)
+USER_STATE_KEYS = ("User_Solve_Result", "Last_User_Solve", "Connected_Group",
+		"Current_Note_Group", "Language")
+
+def load_users_state():
+	'''Open the users state store file (one file for all private chats) and load it in memory'''
+	global users_state
+	global users_state_file
+	# Users state is kept in memory, the file object does not keep another copy of it
+	users_state_file = TSjson(CONST["F_USERS"], True, CONST["CONFIG_CODEC"], cache=False)
+	users_data = users_state_file.read()
+	with users_state_lock:
+		users_state = dict(users_data) if users_data else {}
+
+
+def get_user_default(param):
+	'''Get default value of a private chat property'''
+	if param in DEFAULT_STATE_DATA:
+		return deepcopy(DEFAULT_STATE_DATA[param])
+	return deepcopy(DEFAULT_CONFIG_DATA[param])
+
+
+def get_user_state(user_id, param):
+	'''Get a private chat property from users state store'''
+	with users_state_lock:
+		user_data = get_user_state_data(user_id)
+		user_data["Last_Seen"] = int(time())
+		if param in user_data:
+			return deepcopy(user_data[param])
+	return get_user_default(param)
+
+
+def save_user_state(user_id, properties):
+	'''Store private chat properties in users state store (written later by flush_users_state)'''
+	with users_state_lock:
+		user_data = get_user_state_data(user_id)
+		for property, value in properties.items():
+			user_data[property] = deepcopy(value)
+		user_data["Last_Seen"] = int(time())
+		users_state_dirty.add(str(user_id))
+
+
+def get_user_state_data(user_id):
+	'''Get the state data of a private chat, importing it from an old full chat configuration if
+	it exists. Note: users_state_lock must be acquired by the caller'''
+	global chats_manifest_dirty
+	user_key = str(user_id)
+	user_data = users_state.get(user_key)
+	if user_data is None:
+		user_data = OrderedDict()
+		if int(user_id) in users_legacy_ids:
+			user_data.update(import_legacy_user_config(int(user_id)))
+			users_legacy_ids.discard(int(user_id))
+			users_state_dirty.add(user_key)
+			chats_manifest_dirty = True
+		users_state[user_key] = user_data
+	return user_data
+
+
+def import_legacy_user_config(user_id):
+	'''Get the properties of a private chat from its old full chat configuration and remove it'''
+	user_data = OrderedDict()
+	if chats_config_db is not None:
+		legacy_files = [chats_config_db.get_chat_file(user_id),
+				chats_state_db.get_chat_file(user_id)]
 	else:
-		chat_config_file_name = "{}/{}/{}".format(CONST["CHATS_DIR"], chat_id, CONST["F_CONF"])
-		file["ID"] = chat_id
-		file["File"] = TSjson(chat_config_file_name)
-		files_config_list.append(file)
-	return file["File"]
+		chat_dir = migrate_chat_dir(user_id)
+		legacy_files = [TSjson("{}/{}".format(chat_dir, CONST["F_CONF"]), CONST["CONFIG_JOURNAL"]),
+				TSjson("{}/{}".format(chat_dir, CONST["F_STATE"]))]
+	for legacy_file in legacy_files:
+		legacy_data = legacy_file.read()
+		if legacy_data:
+			for key in USER_STATE_KEYS:
+				if (key in legacy_data) and (legacy_data[key] != get_user_default(key)):
+					user_data[key] = legacy_data[key]
+	# Remove the old chat configuration
+	if chats_config_db is not None:
+		for legacy_file in legacy_files:
+			legacy_file.delete()
+	elif path.exists(chat_dir):
+		rmtree(chat_dir)
+	return user_data
+
+
+def flush_users_state(compact=False):
+	'''Write to users state store file the private chats modified since last call (appended to
+	its journal). Just the snapshot of the changes is taken with users_state_lock acquired, the
+	file is written without it'''
+	global users_state_compact
+	if users_state_file is None:
+		return
+	# Serialize flushes, so changes are written in the same order that they were taken
+	with users_state_flush_lock:
+		with users_state_lock:
+			# Removals can not be journaled, rewrite the full file
+			if users_state_compact:
+				compact = True
+				users_state_compact = False
+			if (not users_state_dirty) and (not compact):
+				return
+			changes = OrderedDict([(user_key, dict(users_state[user_key]))
+					for user_key in users_state_dirty])
+			users_state_dirty.clear()
+			full_write = compact or (not path.exists(users_state_file.file_name)) or \
+					(users_state_file.journal_entries >= CONST["CONFIG_JOURNAL_MAX_ENTRIES"])
+			if full_write:
+				users_data = OrderedDict([(user_key, dict(user_data))
+						for user_key, user_data in users_state.items()])
+		if full_write:
+			users_state_file.write(users_data)
+		else:
+			users_state_file.write(changes, changes)
+			users_state_file.sync()
+
 
 ####################################################################################################
 
-### Telegram Related Functions ###
+### Data retention functions ###
 
-def tlg_check_invite_hash(invite_hash):
-	'''Check if the specified hash link is valid, uses telethon'''
-	valid = os.popen('python3 check_invite.py {}'.format(invite_hash)).read()
-	if "not" in valid:
-		return False
-	elif "valid" in valid:
+def chats_gc(bot):
+	'''Background thread that periodically removes stale chats data (private users not seen in
+	USERS_STATE_TTL_DAYS days, not allowed groups and groups that does not exist anymore). Groups
+	are checked in small batches to not flood Telegram API. The first removal is done after one
+	interval (not at startup)'''
+	# Number of consecutive removals that each group has been found gone
+	gone_checks = {}
+	while True:
+		sleep(CONST["CHATS_GC_INTERVAL"])
+		try:
+			t0 = time()
+			reclaimed_bytes, reclaimed_inodes, removed_users = prune_users_state()
+			removed_groups = 0
+			groups_ids = [chat_id for chat_id in get_chats_ids()
+					if get_chat_type(chat_id) == "group"]
+			for i in range(0, len(groups_ids), CONST["CHATS_GC_BATCH"]):
+				for chat_id in groups_ids[i:i+CONST["CHATS_GC_BATCH"]]:
+					if is_stale_group(bot, chat_id, gone_checks):
+						num_bytes, num_inodes = remove_chat_data(chat_id)
+						reclaimed_bytes = reclaimed_bytes + num_bytes
+						reclaimed_inodes = reclaimed_inodes + num_inodes
+						removed_groups = removed_groups + 1
+				sleep(CONST["CHATS_GC_BATCH_DELAY"])
+			printts("Data GC: Removed {} users and {} groups, reclaimed {} bytes and {} inodes " \
+					"({:.1f}s).".format(removed_users, removed_groups, reclaimed_bytes,
+					reclaimed_inodes, time() - t0))
+		except Exception as e:
+			printts("Error removing stale chats data. {}".format(str(e)))
+
+
+def prune_users_state():
+	'''Remove private users that have not been seen in USERS_STATE_TTL_DAYS days, and old full
+	chat configurations of private users (not imported yet to users state store) that have not
+	been modified in that time. Return the reclaimed bytes and inodes and number of removed
+	users'''
+	global users_state_compact
+	global chats_manifest_dirty
+	reclaimed_bytes = 0
+	reclaimed_inodes = 0
+	expire_time = int(time()) - CONST["USERS_STATE_TTL_DAYS"]*24*60*60
+	with users_state_lock:
+		expired = [user_key for user_key, user_data in users_state.items()
+				if user_data.get("Last_Seen", 0) < expire_time]
+		for user_key in expired:
+			reclaimed_bytes = reclaimed_bytes + len(encode({user_key: users_state.pop(user_key)}))
+			users_state_dirty.discard(user_key)
+		if expired:
+			users_state_compact = True
+		legacy_ids = list(users_legacy_ids)
+	# Database rows have no modification time, they are imported on first access
+	if chats_config_db is not None:
+		return reclaimed_bytes, reclaimed_inodes, len(expired)
+	removed_legacy = 0
+	for user_id in legacy_ids:
+		legacy_dir = get_legacy_user_dir(user_id)
+		if (legacy_dir is None) or (get_legacy_user_mtime(legacy_dir) >= expire_time):
+			continue
+		with users_state_lock:
+			# The user could have been imported meanwhile
+			if user_id not in users_legacy_ids:
+				continue
+			users_legacy_ids.discard(user_id)
+			chats_manifest_dirty = True
+		num_bytes, num_inodes = remove_chat_dir(legacy_dir)
+		reclaimed_bytes = reclaimed_bytes + num_bytes
+		reclaimed_inodes = reclaimed_inodes + num_inodes
+		removed_legacy = removed_legacy + 1
+	return reclaimed_bytes, reclaimed_inodes, len(expired) + removed_legacy
+
+
+def get_legacy_user_dir(user_id):
+	'''Get the old full chat configuration directory of a private user (flat or sharded layout),
+	None if it does not exist'''
+	for chat_dir in (get_chat_dir(user_id), "{}/{}".format(CONST["CHATS_DIR"], user_id)):
+		if path.exists(chat_dir):
+			return chat_dir
+	return None
+
+
+def get_legacy_user_mtime(chat_dir):
+	'''Get the last modification time of an old full chat configuration (the newest of its files,
+	configuration file journal is modified without modifying the configuration file)'''
+	try:
+		return max([path.getmtime(path.join(chat_dir, f_name)) for f_name in listdir(chat_dir)]
+				+ [path.getmtime(chat_dir)])
+	except OSError:
+		return time()
+
+
+def is_stale_group(bot, chat_id, gone_checks):
+	'''Check if a group data can be removed according to retention policies. A group must be
+	found gone in CHATS_GC_GONE_CHECKS consecutive checks (gone_checks keeps the counts)'''
+	if CONST["CHATS_GC_NOT_ALLOWED"] and (not get_chat_config(chat_id, "Allowed")):
 		return True
+	if not CONST["CHATS_GC_GONE"]:
+		return False
+	exists = tlg_chat_exists(bot, chat_id)
+	if exists == False:
+		gone_checks[chat_id] = gone_checks.get(chat_id, 0) + 1
+		if gone_checks[chat_id] >= CONST["CHATS_GC_GONE_CHECKS"]:
+			del gone_checks[chat_id]
+			return True
+	elif exists == True:
+		gone_checks.pop(chat_id, None)
 	return False
 
+
+def remove_chat_data(chat_id):
+	'''Remove all stored data of a chat (cache, registry and files or database rows). Return the
+	reclaimed bytes and inodes'''
+	global chats_manifest_dirty
+	chat_id = int(chat_id)
+	reclaimed_bytes = 0
+	reclaimed_inodes = 0
+	discard_pool_invite_link(chat_id)
+	with invite_links_pool_lock:
+		invite_links_demand.pop(chat_id, None)
+	with groups_lists_lock:
+		if groups_lists is not None:
+			set_groups_lists_group(chat_id, removed=True)
+	with protection_pending_lock:
+		protection_pending.pop(chat_id, None)
+	with muted_users_lock:
+		muted_users.pop(chat_id, None)
+		muted_users_dirty.discard(chat_id)
+	beginner_users.pop(chat_id, None)
+	invalidate_chat_admins(chat_id)
+	with chats_config_cache_lock:
+		for document in ("config", "state"):
+			chats_config_cache.pop((chat_id, document), None)
+			chats_config_dirty.pop((chat_id, document), None)
+	with chats_config_files_lock:
+		chat_files = chats_config_files.pop(chat_id, None)
+		chats_manifest_dirty = True
+	if chats_config_db is not None:
+		for database in (chats_config_db, chats_state_db):
+			chat_data = database.read(chat_id)
+			if chat_data:
+				reclaimed_bytes = reclaimed_bytes + len(encode(chat_data))
+			database.delete(chat_id)
+		return reclaimed_bytes, reclaimed_inodes
+	# The chat directory could still be in flat layout
+	chat_dir = migrate_chat_dir(chat_id)
+	# Remove files through their lock, to not delete them while they are being written
+	if chat_files is not None:
+		with get_chat_lock(chat_id):
+			return remove_chat_dir(chat_dir)
+	return remove_chat_dir(chat_dir)
+
+
+def remove_chat_dir(chat_dir):
+	'''Remove a chat data directory. Return the reclaimed bytes and inodes'''
+	reclaimed_bytes = 0
+	reclaimed_inodes = 0
+	if not path.exists(chat_dir):
+		return reclaimed_bytes, reclaimed_inodes
+	for root, dirs, files in os.walk(chat_dir):
+		reclaimed_inodes = reclaimed_inodes + len(dirs) + len(files)
+		for f_name in files:
+			reclaimed_bytes = reclaimed_bytes + path.getsize(path.join(root, f_name))
+	reclaimed_inodes = reclaimed_inodes + 1
+	rmtree(chat_dir)
+	return reclaimed_bytes, reclaimed_inodes
+
+####################################################################################################
+
+### Telegram Related Functions ###
+
+def tlg_check_invite_hash(invite_hash):
+	'''Check if the specified hash link is valid, uses telethon (through the invite checker
+	worker if it is available, or launching check_invite.py if not)'''
+	if invite_checker is not None:
+		valid = invite_checker.check(invite_hash)
+		if valid is not None:
+			return valid
+		# Do not launch check_invite.py while the worker is connected, both would use the same
+		# Telethon session file. The hash state is unknown (flood wait, server error...), it is
+		# considered valid, so the link is not revoked and exported again for a transient error
+		if invite_checker.available():
+			return True
+	return tlg_check_invite_hashes([invite_hash]).get(invite_hash, False)
+
+
+def tlg_check_invite_hashes(invite_hashes):
+	'''Check several hash links at once with just one check_invite.py process (one Telethon
+	session). Return a dictionary of hash to valid (True/False)'''
+	results = {}
+	try:
+		process = subprocess.run(["python3", "check_invite.py"], input="\n".join(invite_hashes),
+				stdout=subprocess.PIPE, universal_newlines=True)
+		for line in process.stdout.splitlines():
+			result = json.loads(line)
+			if result["hash"] is not None:
+				results[result["hash"]] = (result["status"] == "valid")
+	except Exception as e:
+		printts("Error checking invite links. {}".format(str(e)))
+	return results
+
 def tlg_user_is_admin(bot, user_id, chat_id):
-	'''Check if the specified user is an Administrator of a group given by IDs'''
+	'''Check if the specified user is an Administrator of a group given by IDs (group
+	Administrators are cached)'''
+	group_admins = tlg_get_chat_admins(bot, chat_id, CONST["ADMINS_CACHE_TTL"])
+	if group_admins is None:
+		return None
+	if user_id in group_admins:
+		return True
+	# Denied, check it again if cached Administrators are not recent (user could be promoted)
+	group_admins = tlg_get_chat_admins(bot, chat_id, CONST["ADMINS_CACHE_DENIED_TTL"])
+	if group_admins is None:
+		return None
+	return user_id in group_admins
+
+
+def tlg_get_chat_admins(bot, chat_id, max_age):
+	'''Get the set of Administrators IDs of a group from cache if they were got in the last
+	max_age seconds, or from Telegram if not (concurrent requests of the same group share one
+	Telegram API call)'''
+	chat_id = int(chat_id)
+	with chats_admins_lock:
+		cached = chats_admins.get(chat_id)
+		if (cached is not None) and (time() - cached[1] < max_age):
+			return cached[0]
+		pending = chats_admins_pending.get(chat_id)
+		if pending is None:
+			pending = Event()
+			chats_admins_pending[chat_id] = pending
+			request_owner = True
+		else:
+			request_owner = False
+	# Other thread is getting them, wait for its result
+	if not request_owner:
+		wait_start = time()
+		pending.wait(CONST["ADMINS_CACHE_WAIT_TIMEOUT"])
+		with chats_admins_lock:
+			cached = chats_admins.get(chat_id)
+		if (cached is None) or (cached[1] < wait_start):
+			return None
+		return cached[0]
+	admins_ids = None
 	try:
 		group_admins = bot.get_chat_administrators(chat_id)
+		admins_ids = frozenset([admin.user.id for admin in group_admins])
 	except Exception:
-		return None
-	for admin in group_admins:
-		if user_id == admin.user.id:
-			return True
-	return False
+		pass
+	with chats_admins_lock:
+		if admins_ids is not None:
+			cached = chats_admins.get(chat_id)
+			update_admins_groups(chat_id, cached[0] if cached else frozenset(), admins_ids)
+			chats_admins[chat_id] = (admins_ids, time())
+			chats_admins_failed.pop(chat_id, None)
+		else:
+			# Not requested again for a while to list the groups of an Administrator
+			chats_admins_failed[chat_id] = time()
+		chats_admins_pending.pop(chat_id, None)
+	pending.set()
+	return admins_ids
+
+
+def update_admins_groups(chat_id, old_admins_ids, admins_ids):
+	'''Update the user to administered groups index with the new Administrators of a group.
+	Note: chats_admins_lock must be acquired by the caller'''
+	for user_id in old_admins_ids - admins_ids:
+		user_groups = admins_groups.get(user_id)
+		if user_groups is not None:
+			user_groups.discard(chat_id)
+			if not user_groups:
+				del admins_groups[user_id]
+	for user_id in admins_ids - old_admins_ids:
+		admins_groups.setdefault(user_id, set()).add(chat_id)
+
+
+def invalidate_chat_admins(chat_id):
+	'''Remove the cached Administrators of a group (next check gets them from Telegram)'''
+	chat_id = int(chat_id)
+	with chats_admins_lock:
+		chats_admins_failed.pop(chat_id, None)
+		cached = chats_admins.pop(chat_id, None)
+		if cached is not None:
+			update_admins_groups(chat_id, cached[0], frozenset())
 
 
 def tlg_get_bot_admin_privileges(bot, chat_id):
@@ -869,6 +2034,27 @@ def tlg_check_chat_type(bot, chat_id_or_alias):
 	return chat_type
 
 
+def tlg_chat_exists(bot, chat_id):
+	'''Telegram check if a chat still exists and the Bot is on it (None if it is unknown). Just
+	"chat not found" and Bot kicked or not a member errors mean that the chat is gone (any other
+	error, like an invalid Bot Token, does not)'''
+	try:
+		bot.getChat(chat_id)
+	except (BadRequest, Unauthorized) as e:
+		printts("[{}] {}".format(chat_id, str(e)))
+		error = str(e).lower()
+		if isinstance(e, BadRequest) and ("chat not found" in error):
+			return False
+		if isinstance(e, Unauthorized) and error.startswith("forbidden") and \
+				(("kicked" in error) or ("not a member" in error)):
+			return False
+		return None
+	except Exception as e:
+		printts("[{}] {}".format(chat_id, str(e)))
+		return None
+	return True
+
+
 def tlg_leave_chat(bot, chat_id):
 	'''Telegram Bot try to leave a chat.'''
 	left = False
@@ -882,12 +2068,25 @@ def tlg_leave_chat(bot, chat_id):
 
 def tlg_restrict_user(bot, chat_id, user_id, send_msg=None, send_media=None, 
 		send_stickers_gifs=None, insert_links=None, send_polls=None, 
-		invite_members=None, pin_messages=None, change_group_info=None):
-	'''Telegram Bot try to restrict user permissions in a group.'''
+		invite_members=None, pin_messages=None, change_group_info=None, until_date=None):
+	'''Telegram Bot try to restrict user permissions in a group (until the given date, or forever
+	if it is not provided).'''
 	result = False
 	try:
 		permissions = ChatPermissions(send_msg, send_media, send_polls, send_stickers_gifs, 
 			insert_links, change_group_info, invite_members, pin_messages)
+		result = bot.restrictChatMember(chat_id, user_id, permissions, until_date=until_date)
+	except Exception as e:
+		printts("[{}] {}".format(chat_id, str(e)))
+		result = False
+	return result
+
+
+def tlg_unrestrict_user(bot, chat_id, user_id):
+	'''Telegram Bot try to give back to a user the default permissions of the group.'''
+	result = False
+	try:
+		permissions = bot.getChat(chat_id).permissions
 		result = bot.restrictChatMember(chat_id, user_id, permissions)
 	except Exception as e:
 		printts("[{}] {}".format(chat_id, str(e)))
@@ -942,15 +2141,16 @@ def msg_new_user(update: Update, context: CallbackContext):
 				admin_language = update.message.from_user.language_code[0:2].upper()
 				if admin_language not in TEXT:
 					admin_language = CONST["INIT_LANG"]
-				save_config_property(chat_id, "Language", admin_language)
+				chat_data = {"Language": admin_language}
 				# Get and save chat data
 				chat_title = update.message.chat.title
 				if chat_title:
-					save_config_property(chat_id, "Title", chat_title)
+					chat_data["Title"] = chat_title
 				chat_link = update.message.chat.username
 				if chat_link:
 					chat_link = "@{}".format(chat_link)
-					save_config_property(chat_id, "Link", chat_link)
+					chat_data["Link"] = chat_link
+				save_config_properties(chat_id, chat_data)
 				# Send bot join message
 				try:
 					bot.send_message(chat_id, TEXT[admin_language]["START"])
@@ -962,15 +2162,17 @@ def msg_new_user(update: Update, context: CallbackContext):
 				printts(" ")
 				printts("[{}] New join detected: {} ({})".format(chat_id, join_user_name, join_user_id))
 				# Get and update chat data
+				chat_data = {}
 				chat_title = update.message.chat.title
 				if chat_title:
-					save_config_property(chat_id, "Title", chat_title)
+					chat_data["Title"] = chat_title
 				# Add an unicode Left to Right Mark (LRM) to chat title (fix for arabic, hebrew, etc.)
 				chat_title = add_lrm(chat_title)
 				chat_link = update.message.chat.username
 				if chat_link:
 					chat_link = "@{}".format(chat_link)
-					save_config_property(chat_id, "Link", chat_link)
+					chat_data["Link"] = chat_link
+				save_config_properties(chat_id, chat_data)
 				# Ignore Admins
 				if tlg_user_is_admin(bot, join_user_id, chat_id):
 					printts("[{}] User is an administrator. Skipping the captcha process.".format(chat_id))
@@ -984,19 +2186,17 @@ def msg_new_user(update: Update, context: CallbackContext):
 				if join_user_id in ignored_ids:
 					printts("[{}] User is in ignore list. Skipping the captcha process.".format(chat_id))
 					continue
-				current_user = get_chat_config(chat_id,"Protection_Current_User")
-				current_user_time = get_chat_config(chat_id,"Protection_Current_Time")
 				protected = get_chat_config(chat_id,"Protected")
-				captcha_timeout = get_chat_config(chat_id,"Captcha_Time")
-				if protected and current_user == join_user_id and time() <= current_user_time+(captcha_timeout*60):
+				if protected and admit_pending_user(chat_id, join_user_id):
 					send_welcome_msg(bot,chat_id,update,chat_id)
-					save_config_property(chat_id,"Protection_Current_User",0)
 					printts("[{}] User joined after protected authorization!".format(chat_id))
 					continue
 				elif protected:
 					kick_user(bot,chat_id,join_user_id,update.message.from_user.username)
 					printts("[{}] User kicked because of protection!".format(chat_id))
-					revoke_group_link(bot,chat_id)
+					with get_protection_link_lock(chat_id):
+						discard_pool_invite_link(chat_id)
+						revoke_group_link(bot,chat_id)
 					continue
 				# Check and remove previous join messages of that user (if any)
 				i = 0
@@ -1060,9 +2260,14 @@ def msg_new_user(update: Update, context: CallbackContext):
 					}
 
 					# Add user to mute list until he solves the captcha
-					muted_list = get_chat_config(chat_id,"Muted_List")
-					muted_list.append({"id": join_user_id, "time": time()+FOREVER})
-					save_config_property(chat_id,"Muted_List",muted_list)
+					mute_user(chat_id, join_user_id, time()+FOREVER)
+					# Restrict him to just text messages (to send the captcha solution), so Telegram
+					# drops anything else instead of removing each message
+					if CONST["MUTE_WITH_RESTRICTION"]:
+						tlg_restrict_user(bot, chat_id, join_user_id, send_msg=True,
+							send_media=False, send_stickers_gifs=False, insert_links=False,
+							send_polls=False, invite_members=False, pin_messages=False,
+							change_group_info=False)
 					# Check if this user was before in the chat without solve the captcha
 					prev_user_data = None
 					for user in new_users_list:
@@ -1226,8 +2431,7 @@ def msg_nocmd(update: Update, context: CallbackContext):
 				if msg_text == str(get_chat_config(msg.chat_id,"User_Solve_Result")):
 					bot_msg =TEXT[lang]["USER_START"]
 					save_config_property(msg.chat_id,"Last_User_Solve",time())
-					protected_list = get_protected_list()
-					reply_markup = InlineKeyboardMarkup(protected_list)
+					reply_markup = get_groups_list_markup("protected")
 					bot.send_message(msg.chat_id, TEXT[lang]["USER_START"],reply_markup=reply_markup)
 				else:
 					bot_msg = TEXT[lang]["USER_CAPTCHA_FAILED"]
@@ -1257,13 +2461,15 @@ def msg_nocmd(update: Update, context: CallbackContext):
 		# Get others message data
 
 		# Get and update chat data
+		chat_data = {}
 		chat_title = msg.chat.title
 		if chat_title:
-			save_config_property(chat_id, "Title", chat_title)
+			chat_data["Title"] = chat_title
 		chat_link = msg.chat.username
 		if chat_link:
 			chat_link = "@{}".format(chat_link)
-			save_config_property(chat_id, "Link", chat_link)
+			chat_data["Link"] = chat_link
+		save_config_properties(chat_id, chat_data)
 		user_name = msg.from_user.full_name
 		if msg.from_user.username is not None:
 			user_name = "{}(@{})".format(user_name, msg.from_user.username)
@@ -1311,9 +2517,7 @@ def msg_nocmd(update: Update, context: CallbackContext):
 				if new_user in new_users_list:
 					new_users_list.remove(new_user)
 				#remove user from muted list
-				muted_list = get_chat_config(chat_id,"Muted_List")
-				muted_list = delete_from_muted_list(muted_list,new_user["user_id"])
-				save_config_property(chat_id,"Muted_List",muted_list)
+				unmute_user(chat_id,new_user["user_id"])
 
 				send_welcome_msg(bot,chat_id,update,chat_id)
 				restrict_non_text_msgs = get_chat_config(chat_id, "Restrict_Non_Text")
@@ -1321,6 +2525,9 @@ def msg_nocmd(update: Update, context: CallbackContext):
 					tlg_restrict_user(bot, chat_id, user_id, send_msg=True, send_media=False, 
 						send_stickers_gifs=False, insert_links=False, send_polls=False, 
 						invite_members=False, pin_messages=False, change_group_info=False)
+				elif CONST["MUTE_WITH_RESTRICTION"]:
+					# Lift the captcha mute restriction
+					tlg_unrestrict_user(bot, chat_id, user_id)
 			# The provided message doesn't has the valid captcha number
 			else:
 				# Check if the message has 4 chars
@@ -1526,8 +2733,7 @@ def cmd_start(update: Update, context: CallbackContext):
 			if time() > last_solved + (CONST["VALID_CAPTCHA_TIME"]* 60):
 				show_user_captcha(bot, chat_id,msg.chat.username,lang)
 			else:
-				protected_list = get_protected_list()
-				reply_markup = InlineKeyboardMarkup(protected_list)
+				reply_markup = get_groups_list_markup("protected")
 				bot.send_message(chat_id, TEXT[lang]["USER_START"],reply_markup=reply_markup)
 		else:
 			tlg_msg_to_selfdestruct(update.message)
@@ -1984,8 +3190,7 @@ def cmd_notes(update: Update, context: CallbackContext):
 			if connected < 0:
 				chat_id = connected
 			else:
-				public_list = get_public_list()
-				reply_markup = InlineKeyboardMarkup(public_list)
+				reply_markup = get_groups_list_markup("public")
 				bot.send_message(chat_id, TEXT[lang]["PUBLIC_NOTES"],reply_markup=reply_markup)
 				return
 		trigger_list = get_chat_config(chat_id,"Trigger_List")
@@ -3058,11 +4263,16 @@ def cmd_mute(update: Update, context: CallbackContext):
 			reply_id = reply_to.from_user.id
 			args=[reply_id]
 		if len(args) >=1:
-			muted_list = get_chat_config(chat_id,"Muted_List")
 			mute_time = get_chat_config(chat_id,"Mute_Time")
 			for user_id in args:
-				muted_list.append({"id": int(user_id),"time": time()+mute_time})
-			save_config_property(chat_id,"Muted_List",muted_list)
+				mute_user(chat_id,int(user_id),time()+mute_time)
+				# Restrict the user until mute end, so Telegram drops his messages (muted users
+				# messages are still removed if the Bot can not restrict members)
+				if CONST["MUTE_WITH_RESTRICTION"]:
+					tlg_restrict_user(bot, chat_id, int(user_id), send_msg=False,
+						send_media=False, send_stickers_gifs=False, insert_links=False,
+						send_polls=False, invite_members=False, pin_messages=False,
+						change_group_info=False, until_date=int(time()+mute_time))
 			bot_msg = TEXT[lang]["MUTE_DONE"].format(math.floor(mute_time/60))
 			
 
@@ -3079,14 +4289,27 @@ def cmd_mute(update: Update, context: CallbackContext):
 ### Main Loop Functions ###
 
 def handle_remove_and_kicks(bot):
-	'''Handle remove of sent messages and not verify new users ban'''
-	while True:
+	'''Handle remove of sent messages and not verify new users ban (until a termination signal
+	is received)'''
+	while not shutdown_requested.is_set():
 		# Handle self-messages delete
 		selfdestruct_messages(bot)
 		# Check time for ban new users that has not completed the captcha
 		check_time_to_kick_not_verify_users(bot)
-		# Wait 10s (release CPU usage)
-		sleep(10)
+		# Group commit of chats configuration journals
+		sync_config_journals()
+		# Remove expired users from protected groups admission queues
+		expire_pending_users()
+		# Remove expired muted users and store muted users changes
+		expire_muted_users()
+		save_muted_users()
+		# Write private users state changes
+		flush_users_state()
+		# Write the known chats manifest if there are new chats
+		save_chats_manifest()
+		# Wait 10s (release CPU usage), or less if a termination signal is received
+		shutdown_requested.wait(10)
+	release_resources()
 
 
 def selfdestruct_messages(bot):
@@ -3257,11 +4480,26 @@ def main():
 	# Initialize resources by populating files list and configs with chats found files
 	initialize_resources()
 	printts("Resources initialized.")
+	# Launch the invite links checker worker (connect Telethon client just once)
+	if CONST["INVITE_CHECKER"]:
+		start_invite_checker()
+	# Launch the chats configurations write-behind thread
+	if CONST["CONFIG_WRITE_BEHIND"] or CONST["STATE_WRITE_BEHIND"]:
+		Thread(target=config_flusher, daemon=True).start()
 	# Set messages to be sent silently by default
 	msgs_defaults = Defaults(disable_notification=True)
 	# Create an event handler (updater) for a Bot with the given Token and get the dispatcher
 	updater = Updater(SECRETS["TOKEN"], use_context=True, defaults=msgs_defaults)
 	dp = updater.dispatcher
+	# Launch the protected groups invite links generation thread
+	if CONST["INVITE_LINKS_POOL"]:
+		Thread(target=invite_links_maintainer, args=(updater.bot,), daemon=True).start()
+	# Launch the user to administered groups index update thread
+	if CONST["ADMINS_GROUPS_INDEX_WARM"]:
+		Thread(target=admins_index_warmer, args=(updater.bot,), daemon=True).start()
+	# Launch the stale chats data removal thread
+	if CONST["CHATS_GC"]:
+		Thread(target=chats_gc, args=(updater.bot,), daemon=True).start()
 	# Set to dispatcher all expected commands messages handler
 	dp.add_handler(CommandHandler("start", cmd_start))
 	dp.add_handler(CommandHandler("info", cmd_info))
@@ -1,23 +1,50 @@
+'''
+Check invite links hashes using one Telethon client session for all of them.
+Usage:
+	python3 check_invite.py <hash> [<hash> ...]
+	python3 check_invite.py < hashes.txt (one hash per line, from stdin if no arguments are given)
+Output: One JSON line per hash, {"hash": ..., "status": "valid"|"not"|"error", "latency_ms": ...}
+'''
 from telethon.sync import TelegramClient
 from telethon import functions, types
-from telethon.errors.rpcerrorlist import InviteHashExpiredError
+from telethon.errors.rpcerrorlist import InviteHashExpiredError, InviteHashInvalidError
+from time import time
 import sys
+import json
+
+def print_result(invite_hash, status, start_time):
+	'''Print the JSON line of a hash check result'''
+	print(json.dumps({"hash": invite_hash, "status": status,
+			"latency_ms": round((time() - start_time)*1000, 1)}), flush=True)
+
+def get_hashes():
+	'''Get hashes from arguments, or from stdin (one per line) if there are no arguments'''
+	if len(sys.argv) > 1:
+		for invite_hash in sys.argv[1:]:
+			yield invite_hash
+	else:
+		for line in sys.stdin:
+			if line.strip():
+				yield line.strip()
+
 try:
 	from secrets import SECRETS
 except Exception as e:
-	print("secrets")
+	print(json.dumps({"hash": None, "status": "error", "error": "secrets"}))
 	exit(1)
-if len(sys.argv) > 1:
-	try:
-		with TelegramClient(SECRETS["API_NAME"], SECRETS["API_ID"], SECRETS["API_HASH"]) as client:
-			result = client(functions.messages.CheckChatInviteRequest(hash=sys.argv[1]))
-			print("valid")
-	except InviteHashExpiredError as ex:
-			print("not")
-			sys.exit(1)
-	except Exception as e:
-			print("telethon error")
-			sys.exit(1)
-else:
-	print("please specify invite hash!")
-	sys.exit(1)
\ No newline at end of file
+try:
+	with TelegramClient(SECRETS["API_NAME"], SECRETS["API_ID"], SECRETS["API_HASH"]) as client:
+		for invite_hash in get_hashes():
+			start_time = time()
+			try:
+				client(functions.messages.CheckChatInviteRequest(hash=invite_hash))
+				print_result(invite_hash, "valid", start_time)
+			except (InviteHashExpiredError, InviteHashInvalidError) as ex:
+				# Expired or invalid hash
+				print_result(invite_hash, "not", start_time)
+			except Exception as e:
+				# Any other error (flood wait, authorization, server...) does not tell the hash state
+				print_result(invite_hash, "error", start_time)
+except Exception as e:
+	print(json.dumps({"hash": None, "status": "error", "error": "telethon"}))
+	sys.exit(1)
@@ -29,12 +29,145 @@ CONST = {
     # Chats directory path
     "CHATS_DIR": SCRIPT_PATH + "/data/chats",
 
+    # Store chats directories in hashed subdirectories ("chats/ab/cd/<chat_id>/") instead of all of
+    # them in CHATS_DIR (flat layout directories are moved on first access)
+    "CHATS_DIR_SHARDED": True,
+
     # Directory where create/generate temporary captchas
     "CAPTCHAS_DIR": SCRIPT_PATH + "/data/captchas",
 
+    # Chat runtime state JSON files (captcha, protection, invite link, muted users...)
+    "F_STATE": "state.json",
+
+    # Keep chat runtime state changes in memory and write them later from a background thread
+    "STATE_WRITE_BEHIND": True,
+
+    # Private users state store file (one file for all private chats)
+    "F_USERS": SCRIPT_PATH + "/data/users.json",
+
+    # Days without activity until a private user state is removed
+    "USERS_STATE_TTL_DAYS": 90,
+
+    # Remove stale chats data periodically (expired users and groups of enabled policies)
+    "CHATS_GC": True,
+
+    # Seconds between stale chats data removals
+    "CHATS_GC_INTERVAL": 24*60*60,
+
+    # Number of groups checked at once on stale chats data removal, and seconds between batches
+    "CHATS_GC_BATCH": 20,
+    "CHATS_GC_BATCH_DELAY": 5,
+
+    # Remove data of groups that are not allowed to use the Bot
+    "CHATS_GC_NOT_ALLOWED": False,
+
+    # Remove data of groups that does not exist anymore or the Bot is not a member (disabled by
+    # default, it removes all the group configuration: notes, filters, questions, welcome...)
+    "CHATS_GC_GONE": False,
+
+    # Number of consecutive stale chats data removals that a group must be found gone before its
+    # data is removed (counts are kept in memory, they start again when the Bot is restarted)
+    "CHATS_GC_GONE_CHECKS": 3,
+
+    # Mute users by restricting their permissions in Telegram (messages of muted users are still
+    # removed one by one if the Bot has not permission to restrict members)
+    "MUTE_WITH_RESTRICTION": True,
+
+    # Seconds that groups Administrators are cached
+    "ADMINS_CACHE_TTL": 10*60,
+
+    # Seconds after which a denied user is checked again in Telegram (he could be promoted)
+    "ADMINS_CACHE_DENIED_TTL": 60,
+
+    # Maximum seconds to wait for Administrators requested by other thread
+    "ADMINS_CACHE_WAIT_TIMEOUT": 30,
+
+    # Seconds that cached Administrators are used to list the groups of an Administrator
+    "ADMINS_GROUPS_INDEX_TTL": 6*60*60,
+
+    # Seconds that a group whose Administrators can not be got (Bot is not in the group, deleted
+    # group...) is not requested again to list the groups of an Administrator
+    "ADMINS_GROUPS_INDEX_FAILED_TTL": 60*60,
+
+    # Maximum seconds to wait for not indexed groups Administrators when listing the groups of an
+    # Administrator (the rest of groups are indexed in background)
+    "ADMINS_GROUPS_INDEX_TIMEOUT": 1,
+
+    # Keep the user to administered groups index updated from a background thread
+    "ADMINS_GROUPS_INDEX_WARM": True,
+
+    # Number of parallel requests of groups Administrators
+    "ADMINS_FETCH_WORKERS": 8,
+
+    # Check invite links hashes from a worker with a connected Telethon client (instead of
+    # launching check_invite.py for each check)
+    "INVITE_CHECKER": True,
+
+    # Seconds that invite links hashes check results are cached
+    "INVITE_CHECK_CACHE_TTL": 30,
+
+    # Keep a pre-generated invite link ready for each protected group with recent link requests
+    # [Note: Each link lasts MAX_INVITE_LINK_AGE seconds and up to INVITE_LINKS_POOL_MAX_REFILLS
+    # links are generated every INVITE_LINKS_POOL_INTERVAL seconds, so about
+    # MAX_INVITE_LINK_AGE * INVITE_LINKS_POOL_MAX_REFILLS / INVITE_LINKS_POOL_INTERVAL groups (60
+    # with default values) can have a fresh link at once, any other group gets its link when it is
+    # requested]
+    "INVITE_LINKS_POOL": True,
+
+    # Seconds since the last link request of a protected group to keep generating links for it
+    "INVITE_LINKS_POOL_DEMAND_TTL": 30*60,
+
+    # Seconds between checks of protected groups invite links
+    "INVITE_LINKS_POOL_INTERVAL": 10,
+
+    # Maximum invite links generated in each check, and seconds between them
+    "INVITE_LINKS_POOL_MAX_REFILLS": 5,
+    "INVITE_LINKS_POOL_REFILL_DELAY": 1,
+
+    # Maximum number of users that can be waiting at the same time to join a protected group
+    "PROTECTION_MAX_PENDING": 10,
+
+    # Known chats manifest file (avoids scanning chats directory at startup)
+    "F_CHATS_MANIFEST": SCRIPT_PATH + "/data/chats_manifest.json",
+
     # Chat configurations JSON files
     "F_CONF": "configs.json",
 
+    # Chats configurations schema version (configurations are migrated once when loaded)
+    "CONFIG_SCHEMA_VERSION": 3,
+
+    # Chats configurations storage backend ("json": one file per chat, "sqlite": one database)
+    "CONFIG_BACKEND": "json",
+
+    # Chats configurations SQLite database file (used with "sqlite" backend)
+    "F_CONF_DB": SCRIPT_PATH + "/data/configs.db",
+
+    # Append configuration changes to a journal file instead of rewriting the whole JSON file
+    "CONFIG_JOURNAL": False,
+
+    # Number of journal entries that triggers the compaction of the journal into the JSON file
+    "CONFIG_JOURNAL_MAX_ENTRIES": 100,
+
+    # Keep configuration changes in memory and write them to disk later from a background thread
+    "CONFIG_WRITE_BEHIND": False,
+
+    # Time (in seconds) between each write of the modified chats configurations (write-behind)
+    "CONFIG_FLUSH_INTERVAL": 5,
+
+    # Chats configurations files serialization format ("json", "json_indent", "marshal" or
+    # "msgpack"), existing files in other format are converted on next write
+    "CONFIG_CODEC": "json",
+
+    # Number of locks shared by chats configurations files (each chat uses the one of its ID)
+    "CONFIG_LOCK_STRIPES": 64,
+
+    # Check (one stat call) if a cached chat configuration file has been modified externally, to
+    # allow editing chats configurations files by hand while the Bot is running
+    "CONFIG_CACHE_CHECK_FILE": True,
+
+    # Maximum number of chats configurations kept in memory (least recently used are dropped)
+    "CONFIG_CACHE_MAX_CHATS": 2000,
+
     # Private chat valid captcha time in minutes
     "VALID_CAPTCHA_TIME" : 10,
 
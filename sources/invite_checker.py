@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Script:
+    invite_checker.py
+Description:
+    Invite links hashes validation worker. It keeps one Telethon (MTProto) client connected in a
+    background thread with its own asyncio event loop, so checking a hash is one request instead of
+    launching check_invite.py (new interpreter, Telethon import and login) for each check.
+'''
+
+####################################################################################################
+
+### Imported modules ###
+import asyncio
+from time import time
+from threading import Thread, Lock, Event
+try:
+    from telethon import TelegramClient, functions
+    from telethon.errors.rpcerrorlist import InviteHashExpiredError, InviteHashInvalidError
+    TELETHON_AVAILABLE = True
+except ImportError:
+    TELETHON_AVAILABLE = False
+
+####################################################################################################
+
+### Classes ###
+class InviteChecker(object):
+    '''
+    Thread-Safe invite links hashes checker. Results are cached by hash for cache_ttl seconds and
+    concurrent checks of the same hash share one request (different hashes are sent concurrently
+    through the same connection).
+    '''
+
+    def __init__(self, session_name, api_id, api_hash, cache_ttl=60):
+        '''Class constructor'''
+        self.session_name = session_name
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self.cache_ttl = cache_ttl
+        self.cache = {}
+        self.pending = {}
+        self.lock = Lock()
+        self.loop = None
+        self.client = None
+        self.ready = Event()
+
+
+    def start(self, timeout=30):
+        '''Launch the worker thread and wait until the client is connected. Return True if the
+        worker is available'''
+        if not TELETHON_AVAILABLE:
+            return False
+        Thread(target=self._run, daemon=True).start()
+        self.ready.wait(timeout)
+        return self.available()
+
+
+    def available(self):
+        '''Check if the worker client is connected'''
+        return (self.client is not None) and self.client.is_connected()
+
+
+    def check(self, invite_hash, timeout=30):
+        '''Check if an invite link hash is valid. Return None if it can not be checked (worker not
+        available or connection error)'''
+        if not self.available():
+            return None
+        with self.lock:
+            cached = self.cache.get(invite_hash)
+            if (cached is not None) and (time() - cached[1] < self.cache_ttl):
+                return cached[0]
+            future = self.pending.get(invite_hash)
+            if future is None:
+                future = asyncio.run_coroutine_threadsafe(self._check(invite_hash), self.loop)
+                self.pending[invite_hash] = future
+        try:
+            return future.result(timeout)
+        except Exception:
+            return None
+
+
+    def invalidate(self, invite_hash):
+        '''Remove the cached result of an invite link hash'''
+        with self.lock:
+            self.cache.pop(invite_hash, None)
+
+
+    def _run(self):
+        '''Worker thread, connect the client and run its event loop forever'''
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            # The client uses the event loop of this thread
+            self.client = TelegramClient(self.session_name, self.api_id, self.api_hash)
+            self.loop.run_until_complete(self.client.connect())
+            if not self.loop.run_until_complete(self.client.is_user_authorized()):
+                print("    Invite checker session {} is not authorized.".format(self.session_name))
+                self.loop.run_until_complete(self.client.disconnect())
+                self.client = None
+        except Exception as e:
+            print("    Error connecting invite checker. {}".format(str(e)))
+            self.client = None
+        self.ready.set()
+        if self.client is not None:
+            self.loop.run_forever()
+
+
+    async def _check(self, invite_hash):
+        '''Request the invite link hash to Telegram and cache the result'''
+        try:
+            await self.client(functions.messages.CheckChatInviteRequest(hash=invite_hash))
+            valid = True
+        except (InviteHashExpiredError, InviteHashInvalidError):
+            # Expired or invalid hash
+            valid = False
+        except Exception:
+            # Any other error (connection, flood wait, server...) does not tell the hash state, do
+            # not cache it
+            with self.lock:
+                self.pending.pop(invite_hash, None)
+            raise
+        with self.lock:
+            self.cache[invite_hash] = (valid, time())
+            self.pending.pop(invite_hash, None)
+            # Remove old results
+            if len(self.cache) > 1000:
+                expire_time = time() - self.cache_ttl
+                for cached_hash in [cached_hash for cached_hash, cached in self.cache.items()
+                        if cached[1] < expire_time]:
+                    del self.cache[cached_hash]
+        return valid
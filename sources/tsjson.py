@@ -20,46 +20,203 @@ Version:
 ### Modulos importados ###
 import os
 import json
-from threading import Lock
+import marshal
+import tempfile
+from threading import Lock, Condition
 from collections import OrderedDict
+try:
+    import msgpack # Formato binario opcional
+except ImportError:
+    msgpack = None
+
+# Mascara de permisos del proceso (para crear archivos nuevos con los permisos habituales)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+####################################################################################################
+
+### Codecs ###
+def _json_decode(raw):
+    '''Decodificar datos json (texto utf-8) usando un diccionario ordenado'''
+    return json.loads(raw.decode("utf-8"), object_pairs_hook=OrderedDict)
+
+def _builtin_types(data):
+    '''Convertir recursivamente los diccionarios ordenados a diccionarios (marshal no los soporta)'''
+    if isinstance(data, dict):
+        return {key: _builtin_types(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [_builtin_types(value) for value in data]
+    return data
+
+def _marshal_encode(data):
+    '''Codificar datos marshal'''
+    return marshal.dumps(_builtin_types(data))
+
+def _marshal_decode(raw):
+    '''Decodificar datos marshal'''
+    data = marshal.loads(raw)
+    return OrderedDict(data) if isinstance(data, dict) else data
+
+def _msgpack_encode(data):
+    '''Codificar datos msgpack'''
+    return msgpack.packb(data, use_bin_type=True)
+
+def _msgpack_decode(raw):
+    '''Decodificar datos msgpack'''
+    return msgpack.unpackb(raw, raw=False, object_pairs_hook=OrderedDict, strict_map_key=False)
+
+# Formatos de serializacion soportados: (cabecera, codificador, decodificador)
+# [Nota: Los formatos json no tienen cabecera, un archivo sin cabecera conocida se lee como json]
+CODECS = OrderedDict([
+    ("json", (b"", lambda data: json.dumps(data, ensure_ascii=False,
+            separators=(",", ":")).encode("utf-8"), _json_decode)),
+    ("json_indent", (b"", lambda data: json.dumps(data, ensure_ascii=False,
+            indent=4).encode("utf-8"), _json_decode)),
+    ("marshal", (b"\x00TSJM1\n", _marshal_encode, _marshal_decode)),
+])
+if msgpack is not None:
+    CODECS["msgpack"] = (b"\x00TSJP1\n", _msgpack_encode, _msgpack_decode)
+
+def copy_data(data):
+    '''Copiar recursivamente datos json (mas rapido que deepcopy o volver a deserializar)'''
+    if isinstance(data, dict):
+        return OrderedDict([(key, copy_data(value)) for key, value in data.items()])
+    if isinstance(data, list):
+        return [copy_data(value) for value in data]
+    return data
+
+def encode(data, codec="json"):
+    '''Serializar los datos en el formato indicado (cabecera incluida)'''
+    header, encoder, _ = CODECS[codec]
+    return header + encoder(data)
+
+def decode(raw):
+    '''Deserializar los datos detectando el formato a partir de la cabecera'''
+    for header, _, decoder in CODECS.values():
+        if header and raw.startswith(header):
+            return decoder(raw[len(header):])
+    return _json_decode(raw)
 
 ####################################################################################################
 
-### Clase ###
+### Clases ###
+class RWLock(object):
+    '''
+    Mutex de lectores-escritor: varios lectores concurrentes o un solo escritor (con prioridad
+    para los escritores que esperan). acquire()/release() y "with" adquieren el modo escritor.
+    '''
+
+    def __init__(self):
+        '''Constructor de la clase'''
+        self.condition = Condition(Lock()) # Condicion para esperar a lectores/escritores
+        self.readers = 0 # Numero de lectores activos
+        self.writer = False # Hay un escritor activo
+        self.writers_waiting = 0 # Numero de escritores esperando
+
+
+    def acquire_read(self):
+        '''Adquirir el mutex en modo lector'''
+        with self.condition:
+            while self.writer or self.writers_waiting: # Esperar a que no haya escritores
+                self.condition.wait()
+            self.readers = self.readers + 1
+
+
+    def release_read(self):
+        '''Liberar el mutex en modo lector'''
+        with self.condition:
+            self.readers = self.readers - 1
+            if not self.readers: # Ultimo lector, despertar a los escritores que esperan
+                self.condition.notify_all()
+
+
+    def acquire(self):
+        '''Adquirir el mutex en modo escritor (exclusivo)'''
+        with self.condition:
+            self.writers_waiting = self.writers_waiting + 1
+            while self.writer or self.readers: # Esperar a que no haya nadie mas
+                self.condition.wait()
+            self.writers_waiting = self.writers_waiting - 1
+            self.writer = True
+
+
+    def release(self):
+        '''Liberar el mutex en modo escritor'''
+        with self.condition:
+            self.writer = False
+            self.condition.notify_all()
+
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
 class TSjson(object):
     '''
     Thread-Safe json files read/write library
     '''
 
-    def __init__(self, file_name):
-        '''Constructor de la clase'''
-        self.lock = Lock() #Inicializa el Lock
+    def __init__(self, file_name, journal=False, codec="json", lock=None, cache=True):
+        '''
+        Constructor de la clase
+        [Nota: Se puede indicar un RWLock compartido (p.ej. uno por grupo de archivos), y desactivar
+        la copia en memoria de los ultimos datos leidos si el llamante ya guarda los datos]
+        '''
+        self.lock = lock if lock is not None else RWLock() #Inicializa el Lock (lectores-escritor)
         self.file_name = file_name # Adquiere el nombre del archivo a controlar
+        self.codec = codec # Formato de serializacion para las escrituras (las lecturas lo detectan)
+        self.journal = journal # Usar (o no) un diario de cambios para las escrituras
+        self.journal_name = file_name + ".journal" # Nombre del archivo diario de cambios
+        self.journal_entries = 0 # Numero de entradas del diario pendientes de compactar
+        self.journal_unsynced = False # Hay entradas del diario pendientes de fsync
+        self.cache = cache # Guardar (o no) una copia en memoria de los ultimos datos leidos
+        self.read_cache = None # Ultimos datos leidos (estado del archivo, datos)
+        self.known_stat = None # Ultimo estado conocido del archivo (leido o escrito por nosotros)
 
 
     def read(self):
-        '''Funcion para leer de un archivo json'''
+        '''
+        Funcion para leer de un archivo json
+        [Nota: Si el archivo no ha cambiado desde la ultima lectura (mismo mtime, tamaño e inodo) se
+        devuelve una copia de los ultimos datos sin volver a leer el archivo]
+        '''
         try: # Intentar abrir el archivo
-            self.lock.acquire() # Cerramos (adquirimos) el mutex
-            if not os.path.exists(self.file_name): # Si el archivo no existe
-                read = {} # Devolver un diccionario vacio
-            else: # Si el archivo existe
-                if not os.stat(self.file_name).st_size: # Si el archivo esta vacio
+            self.lock.acquire_read() # Cerramos (adquirimos) el mutex en modo lector
+            stat_key = self._stat_key() # Estado actual del archivo
+            read_cache = self.read_cache
+            if (stat_key is not None) and (read_cache is not None) and (read_cache[0] == stat_key):
+                read = copy_data(read_cache[1]) # Archivo sin cambios, devolver una copia
+            else:
+                if stat_key is None: # Si el archivo no existe
+                    read = {} # Devolver un diccionario vacio
+                elif not stat_key[1]: # Si el archivo esta vacio
                     read = {} # Devolver un diccionario vacio
                 else: # El archivo existe y tiene contenido
-                    with open(self.file_name, "r", encoding="utf-8") as f: # Abrir el archivo en modo lectura
-                        read = json.load(f, object_pairs_hook=OrderedDict) # Leer todo el archivo y devolver la lectura de los datos json usando un diccionario ordenado
+                    read = self._load() # Leer todo el archivo y devolver la lectura de los datos usando un diccionario ordenado
+                read = self._replay_journal(read) # Aplicar los cambios del diario (si hay)
+                if self.cache and (stat_key is not None) and read:
+                    self.read_cache = (stat_key, copy_data(read)) # Guardar los datos leidos
+            self.known_stat = stat_key
         except Exception as e: # Error intentando abrir el archivo
             print("    Error reading json file {}. {}".format(self.file_name, str(e))) # Escribir en consola el error
             read = None # Devolver None
         finally: # Para acabar, haya habido excepcion o no
-            self.lock.release() # Abrimos (liberamos) el mutex
+            self.lock.release_read() # Abrimos (liberamos) el mutex de lector
         
         return read # Devolver el resultado de la lectura de la funcion
 
 
-    def write(self, data):
-        '''Funcion para escribir en un archivo json'''
+    def write(self, data, changes=None):
+        '''
+        Funcion para escribir en un archivo json
+        [Nota: Si el diario esta activado y se indican los cambios (diccionario con las claves
+        modificadas), solo se añaden dichos cambios al final del diario, sin reescribir el archivo]
+        '''
         # Si no existe el directorio que contiene los archivos de datos, lo creamos
         directory = os.path.dirname(self.file_name) # Obtener el nombre del directorio que contiene al archivo
         if not os.path.exists(directory): # Si el directorio (ruta) no existe
@@ -67,14 +224,141 @@ class TSjson(object):
         
         try: # Intentar abrir el archivo
             self.lock.acquire() # Cerramos (adquirimos) el mutex
-            with open(self.file_name, 'w', encoding="utf-8") as f: # Abrir el archivo en modo escritura (sobre-escribe)
-                json.dump(data, fp=f, ensure_ascii=False, indent=4) # Escribimos en el archivo los datos json asegurando todos los caracteres ascii, codificacion utf-8 y una "indentacion" de 4 espacios
+            if self.journal and changes and os.path.exists(self.file_name): # Escritura en el diario
+                with open(self.journal_name, 'a', encoding="utf-8") as f: # Abrir el diario en modo añadir
+                    f.write(json.dumps(changes, ensure_ascii=False) + "\n") # Añadir una linea con los cambios
+                self.journal_entries = self.journal_entries + 1
+                self.journal_unsynced = True
+            else: # Escritura completa del archivo
+                self._atomic_write(data) # Escribimos los datos de forma atomica
+                self._remove_journal() # Los cambios del diario ya estan incluidos en los datos
+            self.known_stat = self._stat_key() # Estado del archivo tras nuestra escritura
+            self.read_cache = None # No copiar los datos en cada escritura, se guardan en la siguiente lectura
         except: # Error intentando abrir el archivo
             print("    Error cuando se abria para escritura, el archivo {}".format(self.file_name)) # Escribir en consola el error
         finally: # Para acabar, haya habido excepcion o no
             self.lock.release() # Abrimos (liberamos) el mutex
 
 
+    def sync(self):
+        '''Funcion para forzar a disco (fsync) todas las entradas del diario escritas desde el ultimo sync'''
+        with self.lock: # Cerramos (adquirimos) el mutex
+            if not self.journal_unsynced: # Nada pendiente
+                return
+            try:
+                with open(self.journal_name, 'a', encoding="utf-8") as f: # Abrir el diario
+                    os.fsync(f.fileno()) # Una sola llamada fsync para todas las entradas pendientes
+                self.journal_unsynced = False
+            except Exception as e:
+                print("    Error sincronizando el diario {}. {}".format(self.journal_name, str(e)))
+
+
+    def compact(self):
+        '''Funcion para compactar el diario en el archivo json (escritura atomica y fsync)'''
+        with self.lock: # Cerramos (adquirimos) el mutex
+            if not os.path.exists(self.journal_name): # Sin diario, nada que compactar
+                return
+            try:
+                data = self._load() # Leer los datos base
+                data = self._replay_journal(data) # Aplicar los cambios del diario
+                self._atomic_write(data, sync=True) # Escribir los datos completos de forma segura
+                self._remove_journal() # Eliminar el diario ya aplicado
+                self.known_stat = self._stat_key() # Estado del archivo tras la compactacion
+            except Exception as e:
+                print("    Error compactando el diario {}. {}".format(self.journal_name, str(e)))
+
+
+    def _atomic_write(self, data, sync=False):
+        '''
+        Funcion para escribir los datos json en un archivo temporal y reemplazar el archivo
+        original con el (os.replace es atomico, un lector nunca ve un archivo vacio o a medias)
+        [Nota: El mutex debe estar adquirido por la funcion que llama]
+        '''
+        directory = os.path.dirname(self.file_name) # Directorio del archivo
+        fd, temp_name = tempfile.mkstemp(dir=directory, prefix=".tmp_") # Archivo temporal en el mismo directorio
+        try:
+            # mkstemp crea el archivo con permisos 0600, mantener los del archivo original (o los de un archivo nuevo)
+            try:
+                mode = os.stat(self.file_name).st_mode & 0o7777
+            except OSError:
+                mode = 0o666 & ~_UMASK
+            os.chmod(temp_name, mode)
+            with os.fdopen(fd, 'wb') as f: # Abrir el archivo temporal en modo escritura binaria
+                f.write(encode(data, self.codec)) # Escribimos en el archivo los datos serializados con el formato configurado
+                if sync: # Si se pide, forzar los datos a disco antes de reemplazar
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(temp_name, self.file_name) # Reemplazar el archivo original de forma atomica
+            self.read_cache = None # Los datos en memoria ya no son validos
+            self.known_stat = self._stat_key() # Estado del archivo tras nuestra escritura
+        except: # Error escribiendo, eliminar el archivo temporal
+            if os.path.exists(temp_name):
+                os.remove(temp_name)
+            raise
+
+
+    def drop_cache(self):
+        '''Funcion para liberar la copia en memoria de los ultimos datos leidos/escritos'''
+        self.read_cache = None
+
+
+    def changed(self):
+        '''Funcion para determinar si el archivo ha sido modificado externamente (una llamada stat)'''
+        return self._stat_key() != self.known_stat
+
+
+    def _stat_key(self):
+        '''Obtener el estado del archivo (mtime, tamaño e inodo, y los del diario) o None si no existe'''
+        try:
+            st = os.stat(self.file_name)
+        except OSError: # El archivo no existe
+            return None
+        stat_key = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if self.journal: # Los cambios del diario tambien modifican los datos
+            try:
+                st = os.stat(self.journal_name)
+                stat_key = stat_key + (st.st_mtime_ns, st.st_size, st.st_ino)
+            except OSError: # Sin diario
+                pass
+        return stat_key
+
+
+    def _load(self):
+        '''
+        Funcion para leer y deserializar el archivo, detectando su formato por la cabecera
+        [Nota: El mutex debe estar adquirido por la funcion que llama]
+        '''
+        with open(self.file_name, "rb") as f: # Abrir el archivo en modo lectura binaria
+            return decode(f.read()) # Deserializar todo el contenido
+
+
+    def _replay_journal(self, data):
+        '''Funcion para aplicar sobre los datos leidos los cambios del diario (si existe)'''
+        if not self.journal or not os.path.exists(self.journal_name): # Sin diario
+            return data
+        if not data: # Sin datos base
+            data = OrderedDict()
+        entries = 0
+        with open(self.journal_name, "r", encoding="utf-8") as f: # Abrir el diario en modo lectura
+            for line in f: # Para cada entrada del diario
+                try:
+                    changes = json.loads(line, object_pairs_hook=OrderedDict)
+                except ValueError: # Ultima linea incompleta (caida durante la escritura), ignorarla
+                    break
+                data.update(changes) # Aplicar los cambios
+                entries = entries + 1
+        self.journal_entries = entries
+        return data
+
+
+    def _remove_journal(self):
+        '''Funcion para eliminar el diario de cambios (si existe)'''
+        if os.path.exists(self.journal_name):
+            os.remove(self.journal_name)
+        self.journal_entries = 0
+        self.journal_unsynced = False
+
+
     def read_content(self):
         '''Funcion para leer el contenido de un archivo json (datos json)'''
         read = self.read() # Leer todo el archivo json
@@ -97,24 +381,17 @@ class TSjson(object):
             
             if data: # Si el dato no esta vacio
                 if os.path.exists(self.file_name) and os.stat(self.file_name).st_size: # Si el archivo existe y no esta vacio
-                    with open(self.file_name, "r", encoding="utf-8") as f: # Abrir el archivo en modo lectura
-                        content = json.load(f, object_pairs_hook=OrderedDict) # Leer todo el archivo y devolver la lectura de los datos json usando un diccionario ordenado
+                    content = self._load() # Leer todo el archivo y devolver la lectura de los datos usando un diccionario ordenado
 
                     content['Content'].append(data) # Añadir los nuevos datos al contenido del json
                     
-                    with open(self.file_name, 'w', encoding="utf-8") as f: # Abrir el archivo en modo escritura (sobre-escribe)
-                        json.dump(content, fp=f, ensure_ascii=False, indent=4)
+                    self._atomic_write(content) # Escribimos el contenido de forma atomica
                 else: # El archivo no existe o esta vacio
-                    with open(self.file_name, 'w', encoding="utf-8") as f: # Abrir el archivo en modo escritura (sobre-escribe)
-                        f.write('\n{\n    "Content": []\n}\n') # Escribir la estructura de contenido basica
-                    
-                    with open(self.file_name, "r", encoding="utf-8") as f: # Abrir el archivo en modo lectura
-                        content = json.load(f) # Leer todo el archivo
+                    content = OrderedDict([('Content', [])]) # Estructura de contenido basica
 
                     content['Content'].append(data) # Añadir los datos al contenido del json
 
-                    with open(self.file_name, 'w', encoding="utf-8") as f:  # Abrir el archivo en modo escritura (sobre-escribe)
-                        json.dump(content, fp=f, ensure_ascii=False, indent=4)
+                    self._atomic_write(content) # Escribimos el contenido de forma atomica
         except IOError as e:
             print("    I/O error({0}): {1}".format(e.errno, e.strerror))
         except ValueError:
@@ -154,14 +431,14 @@ class TSjson(object):
         Funcion para eliminar un dato json concreto dentro del archivo json a partir de un elemento identificador unico (uide)
         [Nota: Cada dato json necesita al menos 1 elemento identificador unico (uide), si no es asi, la eliminacion se producira en el primer dato con dicho elemento uide que se encuentre]
         '''
-        file_content = self.read_content() # Leer el contenido del archivo json
-        for data in file_content: # Para cada dato json contenido
+        file_data = self.read() # Leer todo el archivo json
+        if not file_data: # Archivo vacio o inexistente, nada que eliminar
+            return
+        for data in file_data['Content']: # Para cada dato json contenido
             if data[uide] == element_value: # Si el dato coincide con el buscado
-                file_content.remove(data) # Eliminamos el dato
+                file_data['Content'].remove(data) # Eliminamos el dato
+                self.write(file_data) # Escribimos todo el contenido restante (una sola escritura)
                 break # Interrumpir y salir del bucle
-        self.clear_content() # Eliminamos el contenido del archivo
-        if file_content: # Si hay algun dato en el contenido modificado
-            self.write_content(file_content[0]) # Write the modified content (without the item)
 
 
     def search_by_uide(self, element_value, uide):
@@ -233,8 +510,7 @@ class TSjson(object):
         try: # Intentar abrir el archivo
             self.lock.acquire() # Cerramos (adquirimos) el mutex
             if os.path.exists(self.file_name) and os.stat(self.file_name).st_size: # Si el archivo existe y no esta vacio
-                with open(self.file_name, 'w', encoding="utf-8") as f: # Abrir el archivo en modo escritura (sobre-escribe)
-                    f.write('\n{\n    "Content": [\n    ]\n}\n') # Escribir la estructura de contenido basica
+                self._atomic_write(OrderedDict([('Content', [])])) # Escribir la estructura de contenido basica
         except: # Error intentando abrir el archivo
             print("    Error cuando se abria para escritura, el archivo {}".format(self.file_name)) # Escribir en consola el error
         finally: # Para acabar, haya habido excepcion o no
@@ -246,4 +522,181 @@ class TSjson(object):
         self.lock.acquire() # Cerramos (adquirimos) el mutex
         if os.path.exists(self.file_name): # Si el archivo existe
             os.remove(self.file_name) # Eliminamos el archivo
+        self._remove_journal() # Eliminamos tambien el diario (si existe)
+        self.read_cache = None # Los datos en memoria ya no son validos
         self.lock.release() # Abrimos (liberamos) el mutex
+
+
+class _Unindexed(object):
+    '''Clave unica (por identidad) de un dato sin uides o con uides repetidos, que no se indexa'''
+    pass
+
+
+class TSjsonIndexed(TSjson):
+    '''
+    Thread-Safe json files content records store indexed by unique identifier elements (uides).
+    Los datos se mantienen en memoria con un indice (diccionario) por los uides configurados, asi
+    las busquedas y actualizaciones son O(1) y cada modificacion realiza una sola escritura.
+    [Nota: Los datos sin uides o con uides repetidos se mantienen (sin indexar) para no perderlos
+    al reescribir el archivo, solo se encuentran con busquedas lineales]
+    '''
+
+    def __init__(self, file_name, uides, journal=False, codec="json", lock=None):
+        '''Constructor de la clase'''
+        super().__init__(file_name, journal, codec, lock)
+        if isinstance(uides, str): # Un solo uide
+            uides = [uides]
+        self.uides = tuple(uides) # Elementos que identifican cada dato (clave del indice)
+        self.records = None # Indice de datos (se carga del archivo en el primer acceso)
+        self.records_lock = Lock() # Mutex del indice en memoria
+
+
+    def _key(self, data, uides=None):
+        '''Obtener la clave del indice de un dato json'''
+        return tuple(data.get(uide) for uide in (uides or self.uides))
+
+
+    def _load_records(self):
+        '''
+        Cargar el indice desde el archivo si aun no esta cargado
+        [Nota: El mutex del indice debe estar adquirido por la funcion que llama]
+        '''
+        if self.records is None:
+            self.records = OrderedDict()
+            file_data = super().read() # Leer todo el archivo json
+            if file_data and ('Content' in file_data):
+                for data in file_data['Content']:
+                    if data: # Ignorar datos vacios
+                        self.records[self._record_key(data)] = data
+        return self.records
+
+
+    def _record_key(self, data):
+        '''
+        Obtener la clave del indice para añadir un dato (una clave sin indexar si no tiene uides o
+        si ya hay otro dato con los mismos uides)
+        [Nota: El mutex del indice debe estar adquirido por la funcion que llama]
+        '''
+        key = self._key(data)
+        if (None in key) or (key in self.records):
+            return _Unindexed()
+        return key
+
+
+    def _save_records(self):
+        '''
+        Escribir todos los datos del indice en el archivo (una sola escritura)
+        [Nota: El mutex del indice debe estar adquirido por la funcion que llama]
+        '''
+        self.write(OrderedDict([('Content', list(self.records.values()))]))
+
+
+    def read_content(self):
+        '''Funcion para leer el contenido (lista de datos json)'''
+        with self.records_lock:
+            return [copy_data(data) for data in self._load_records().values()] # Copias, el indice no se modifica
+
+
+    def write_content(self, data):
+        '''Funcion para añadir un dato json (reemplaza el dato existente con los mismos uides)'''
+        if not data: # Si el dato esta vacio
+            return
+        with self.records_lock:
+            records = self._load_records()
+            key = self._key(data)
+            if None in key: # Sin uides, se añade sin indexar
+                key = _Unindexed()
+            records[key] = copy_data(data)
+            self._save_records()
+
+
+    def is_in(self, data):
+        '''Funcion para determinar si el contenido tiene un dato json concreto'''
+        with self.records_lock:
+            return self._load_records().get(self._key(data)) == data
+
+
+    def is_in_position(self, data):
+        '''Funcion para determinar si el contenido tiene un dato json concreto y la posicion de este'''
+        with self.records_lock:
+            records = self._load_records()
+            if records.get(self._key(data)) != data:
+                return False, len(records)
+            return True, list(records.keys()).index(self._key(data))
+
+
+    def search_by_uide(self, element_value, uide):
+        '''Funcion para buscar un dato json a partir de un elemento identificador unico (uide)'''
+        result = dict() # Diccionario para el resultado de la busqueda
+        result['found'] = False # Dato inicialmente no encontrado
+        result['data'] = None # Dato encontrado inicialmente con ningun valor
+        with self.records_lock:
+            records = self._load_records()
+            if self.uides == (uide,): # Busqueda por el indice
+                data = records.get((element_value,))
+            else: # Busqueda lineal por un elemento que no es el indice
+                data = next((d for d in records.values() if d.get(uide) == element_value), None)
+        if data is not None:
+            result['found'] = True
+            result['data'] = copy_data(data) # Copia, el indice no se modifica
+        return result
+
+
+    def update(self, data, uide):
+        '''Funcion para actualizar un dato json identificado por un uide'''
+        self._update(data, (uide,))
+
+
+    def update_twice(self, data, uide1, uide2):
+        '''Funcion para actualizar un dato json identificado por dos uides'''
+        self._update(data, (uide1, uide2))
+
+
+    def _update(self, data, uides):
+        '''Funcion para actualizar un dato json identificado por los uides indicados'''
+        with self.records_lock:
+            records = self._load_records()
+            if self.uides == uides: # Busqueda por el indice
+                key = self._key(data) if self._key(data) in records else None
+            else: # Busqueda lineal por elementos que no son el indice
+                key = next((k for k, d in records.items()
+                        if self._key(d, uides) == self._key(data, uides)), None)
+            if key is None: # No se encontro ningun dato json con dicho UIDE
+                print("    Error: UIDE no encontrado en el archivo, o el archivo no existe")
+                return
+            if key == self._key(data): # Reemplazar el dato
+                records[key] = copy_data(data)
+            else: # La clave del indice ha cambiado, reemplazar el dato en su posicion
+                new_key = self._key(data)
+                if (None in new_key) or (new_key in records): # Sin uides o ya usados, sin indexar
+                    new_key = _Unindexed()
+                self.records = OrderedDict([((new_key, copy_data(data)) if k == key else (k, d))
+                        for k, d in records.items()])
+            self._save_records()
+
+
+    def remove_by_uide(self, element_value, uide):
+        '''Funcion para eliminar un dato json a partir de un elemento identificador unico (uide)'''
+        with self.records_lock:
+            records = self._load_records()
+            if self.uides == (uide,): # Busqueda por el indice
+                key = (element_value,) if (element_value,) in records else None
+            else: # Busqueda lineal por un elemento que no es el indice
+                key = next((k for k, d in records.items() if d.get(uide) == element_value), None)
+            if key is not None:
+                del records[key]
+                self._save_records()
+
+
+    def clear_content(self):
+        '''Funcion para limpiar todos los datos'''
+        with self.records_lock:
+            self.records = OrderedDict()
+            super().clear_content()
+
+
+    def delete(self):
+        '''Funcion para eliminar el archivo json'''
+        with self.records_lock:
+            self.records = None
+            super().delete()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Script:
+    tssqlite.py
+Description:
+    Thread-Safe SQLite chats configurations storage (alternative to one TSjson file per chat).
+    Usage as script migrates an existing JSON chats directory tree into a database:
+        python3 tssqlite.py <chats_dir> <config_file_name> <database_file>
+'''
+
+####################################################################################################
+
+### Imported modules ###
+import os
+import sys
+import json
+import sqlite3
+from threading import Lock, local
+from collections import OrderedDict
+from tsjson import TSjson
+
+####################################################################################################
+
+### Functions ###
+def chats_dirs(chats_dir):
+    '''Get (chat_id, chat_dir) of all chats directories, in flat ("<chats_dir>/<chat_id>") and
+    sharded ("<chats_dir>/ab/cd/<chat_id>") layouts'''
+    for name in os.listdir(chats_dir):
+        if len(name) != 2: # Flat layout chat directory
+            yield name, os.path.join(chats_dir, name)
+            continue
+        shard_dir = os.path.join(chats_dir, name)
+        for subshard in os.listdir(shard_dir):
+            subshard_dir = os.path.join(shard_dir, subshard)
+            for chat_id in os.listdir(subshard_dir):
+                yield chat_id, os.path.join(subshard_dir, chat_id)
+
+def migrate_database(chats_dir, database_file, tables_files):
+    '''Create a database from a TSjson chats files tree, tables_files is a list of (table,
+    config_file_name). The database is built in a temporary file that is renamed when the
+    migration is complete, so an interrupted migration is done again from scratch. Return the
+    number of imported chats of each table'''
+    temp_file = database_file + ".migrating"
+    for file_name in (temp_file, temp_file + "-wal", temp_file + "-shm"):
+        if os.path.exists(file_name):
+            os.remove(file_name)
+    imported = []
+    for table, config_file_name in tables_files:
+        database = TSsqlite(temp_file, table)
+        imported.append(database.migrate_from_json(chats_dir, config_file_name))
+        # Last connection close writes the WAL into the database file
+        database.close()
+    os.replace(temp_file, database_file)
+    return imported
+
+####################################################################################################
+
+### Classes ###
+class TSsqlite(object):
+    '''
+    Thread-Safe SQLite chats configurations storage. It stores one row per chat with the chat
+    configuration serialized as JSON. Each thread uses its own connection and the database works
+    in WAL mode, so readers never block the writer and vice versa.
+    '''
+
+    def __init__(self, file_name, table="chats"):
+        '''Class constructor (several storages can share the same database using other tables)'''
+        self.file_name = file_name
+        self.table = table
+        self.thread_data = local()
+        # Create database directory and table if they do not exist
+        directory = os.path.dirname(self.file_name)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        connection = self.connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS {} (id INTEGER PRIMARY KEY, "
+                "data TEXT NOT NULL)".format(self.table))
+        connection.commit()
+
+
+    def connection(self):
+        '''Get the database connection of the current thread (create it if it does not exist)'''
+        connection = getattr(self.thread_data, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.file_name, timeout=30)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.thread_data.connection = connection
+        return connection
+
+
+    def read(self, chat_id):
+        '''Read a chat configuration (empty dictionary if the chat is not stored)'''
+        try:
+            row = self.connection().execute("SELECT data FROM {} WHERE id=?".format(self.table),
+                    (int(chat_id),)).fetchone()
+            if row is None:
+                return {}
+            return json.loads(row[0], object_pairs_hook=OrderedDict)
+        except Exception as e:
+            print("    Error reading chat {} from database {}. {}".format(chat_id,
+                    self.file_name, str(e)))
+            return None
+
+
+    def write(self, chat_id, data):
+        '''Write (insert or replace) a chat configuration with a single row UPSERT'''
+        try:
+            connection = self.connection()
+            with connection:
+                connection.execute("INSERT INTO {} (id, data) VALUES (?, ?) "
+                        "ON CONFLICT(id) DO UPDATE SET data=excluded.data".format(self.table),
+                        (int(chat_id), json.dumps(data, ensure_ascii=False)))
+        except Exception as e:
+            print("    Error writing chat {} to database {}. {}".format(chat_id,
+                    self.file_name, str(e)))
+
+
+    def delete(self, chat_id):
+        '''Remove a chat configuration'''
+        connection = self.connection()
+        with connection:
+            connection.execute("DELETE FROM {} WHERE id=?".format(self.table), (int(chat_id),))
+
+
+    def chats_ids(self):
+        '''Get a list of all stored chats IDs'''
+        rows = self.connection().execute("SELECT id FROM {}".format(self.table)).fetchall()
+        return [row[0] for row in rows]
+
+
+    def close(self):
+        '''Close the database connection of the current thread'''
+        connection = getattr(self.thread_data, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.thread_data.connection = None
+
+
+    def get_chat_file(self, chat_id, lock=None):
+        '''Get a TSjson like object to read/write the configuration of the specified chat'''
+        return TSsqliteChat(self, chat_id, lock)
+
+
+    def migrate_from_json(self, chats_dir, config_file_name):
+        '''Import all chats configurations from a "<chats_dir>/<chat_id>/<config_file_name>"
+        TSjson files tree (any codec, journals included). Return the number of imported chats.'''
+        imported = 0
+        if not os.path.exists(chats_dir):
+            return imported
+        connection = self.connection()
+        with connection:
+            for chat_id, chat_dir in chats_dirs(chats_dir):
+                file_path = os.path.join(chat_dir, config_file_name)
+                try:
+                    chat_id = int(chat_id)
+                except ValueError:
+                    print("    Ignoring {} on migration. Not a chat directory".format(file_path))
+                    continue
+                # Read through TSjson, it detects the file codec and applies the file journal
+                data = TSjson(file_path, journal=True).read()
+                if data is None:
+                    print("    Ignoring {} on migration. It can not be read".format(file_path))
+                    continue
+                if not data:
+                    continue
+                connection.execute("INSERT INTO {} (id, data) VALUES (?, ?) "
+                        "ON CONFLICT(id) DO UPDATE SET data=excluded.data".format(self.table),
+                        (chat_id, json.dumps(data, ensure_ascii=False)))
+                imported = imported + 1
+        return imported
+
+
+class TSsqliteChat(object):
+    '''
+    Single chat view of a TSsqlite storage that provides the same read()/write() interface (and
+    lock) than a TSjson file.
+    '''
+
+    def __init__(self, database, chat_id, lock=None):
+        '''Class constructor'''
+        self.lock = lock if lock is not None else Lock()
+        self.database = database
+        self.chat_id = int(chat_id)
+        self.file_name = "{}#{}".format(database.file_name, self.chat_id)
+
+
+    def read(self):
+        '''Read the chat configuration'''
+        return self.database.read(self.chat_id)
+
+
+    def write(self, data, changes=None):
+        '''Write the chat configuration (changes argument is ignored, it is already one UPSERT)'''
+        with self.lock:
+            self.database.write(self.chat_id, data)
+
+
+    def delete(self):
+        '''Remove the chat configuration'''
+        with self.lock:
+            self.database.delete(self.chat_id)
+
+
+    def changed(self):
+        '''Database rows are just modified through this storage, never externally'''
+        return False
+
+####################################################################################################
+
+### Migration script ###
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        print("Usage: python3 tssqlite.py <chats_dir> <config_file_name> <database_file>")
+        sys.exit(1)
+    database = TSsqlite(sys.argv[3])
+    num_chats = database.migrate_from_json(sys.argv[1], sys.argv[2])
+    print("Migrated {} chats into {}".format(num_chats, sys.argv[3]))
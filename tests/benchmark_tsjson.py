@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Read/write latency of TSjson codecs for chat configurations from 1KB to 1MB.
+# Usage: python3 benchmark_tsjson.py [iterations]
+
+import os
+import sys
+import shutil
+import tempfile
+from time import perf_counter
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../sources/'))
+from tsjson import TSjson, CODECS, encode
+
+SIZES = [1024, 10*1024, 100*1024, 1024*1024]
+
+
+def build_config(size):
+	'''Build a chat configuration like data structure of approximately the given size'''
+	config = {
+		"Title": "Benchmark Group ✓",
+		"Enabled": True,
+		"Captcha_Time": 2,
+		"Muted_List": [{"id": 123456789, "time": 1600000000.5}],
+		"Trigger_List": {},
+		"Filter_List": {},
+	}
+	note = "<b>Note</b> with some <i>html</i> text and unicode ñ€ content. " * 8
+	i = 0
+	while len(encode(config, "json")) < size:
+		# Each text is a different string (marshal would store repeated objects just once)
+		config["Trigger_List"]["note{}".format(i)] = "{} {}".format(i, note)
+		config["Filter_List"]["filter{}".format(i)] = "{} {}".format(i, note)
+		i = i + 1
+	return config
+
+
+def measure(function, iterations):
+	'''Get average function call latency in milliseconds'''
+	start = perf_counter()
+	for _ in range(iterations):
+		function()
+	return (perf_counter() - start) * 1000 / iterations
+
+
+def main():
+	iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+	work_dir = tempfile.mkdtemp()
+	try:
+		print("{:>8} {:>12} {:>10} {:>10} {:>10}".format("size", "codec", "file KB",
+				"read ms", "write ms"))
+		for size in SIZES:
+			config = build_config(size)
+			for codec in CODECS:
+				fjson = TSjson(os.path.join(work_dir, "{}_{}".format(codec, size)), codec=codec)
+				write_ms = measure(lambda: fjson.write(config), iterations)
+				# Drop the in-memory copy before each read to measure file load and decode
+				read_ms = measure(lambda: (fjson.drop_cache(), fjson.read()), iterations)
+				file_kb = os.stat(fjson.file_name).st_size / 1024
+				print("{:>8} {:>12} {:>10.1f} {:>10.3f} {:>10.3f}".format(size, codec, file_kb,
+						read_ms, write_ms))
+	finally:
+		shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+	main()
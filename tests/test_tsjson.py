@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Regression tests of TSjson and TSjsonIndexed records content functions.
+# Usage: python3 test_tsjson.py (or pytest)
+
+import os
+import sys
+import shutil
+import tempfile
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../sources/'))
+from tsjson import TSjson, TSjsonIndexed
+
+RECORDS = [
+	{"id": 1, "text": "first"},
+	{"id": 2, "text": "middle"},
+	{"id": 3, "text": "last"},
+]
+
+
+def new_file(file_class, *args):
+	'''Create a json file in a new temporary directory with test records'''
+	work_dir = tempfile.mkdtemp()
+	fjson = file_class(os.path.join(work_dir, "records.json"), *args)
+	for record in RECORDS:
+		fjson.write_content(dict(record))
+	return work_dir, fjson
+
+
+def test_remove_by_uide_keeps_other_records():
+	'''Removing a middle record must keep all the other records'''
+	work_dir, fjson = new_file(TSjson)
+	try:
+		fjson.remove_by_uide(2, "id")
+		assert fjson.read_content() == [RECORDS[0], RECORDS[2]]
+		# Removing an unknown record does not modify the content
+		fjson.remove_by_uide(9, "id")
+		assert fjson.read_content() == [RECORDS[0], RECORDS[2]]
+	finally:
+		shutil.rmtree(work_dir)
+
+
+def test_indexed_remove_by_uide_keeps_other_records():
+	'''Removing a middle record must keep all the other records, in memory and in file'''
+	work_dir, fjson = new_file(TSjsonIndexed, "id")
+	try:
+		fjson.remove_by_uide(2, "id")
+		assert fjson.read_content() == [RECORDS[0], RECORDS[2]]
+		assert not fjson.search_by_uide(2, "id")["found"]
+		assert TSjson(fjson.file_name).read_content() == [RECORDS[0], RECORDS[2]]
+		# Remove by an element that is not the index
+		fjson.remove_by_uide("last", "text")
+		assert TSjsonIndexed(fjson.file_name, "id").read_content() == [RECORDS[0]]
+	finally:
+		shutil.rmtree(work_dir)
+
+
+def test_indexed_update():
+	'''Updating a record must replace it in its position, in memory and in file'''
+	work_dir, fjson = new_file(TSjsonIndexed, "id")
+	try:
+		fjson.update({"id": 2, "text": "updated"}, "id")
+		expected = [RECORDS[0], {"id": 2, "text": "updated"}, RECORDS[2]]
+		assert fjson.read_content() == expected
+		assert fjson.search_by_uide(2, "id")["data"] == {"id": 2, "text": "updated"}
+		assert fjson.is_in_position({"id": 2, "text": "updated"}) == (True, 1)
+		assert TSjsonIndexed(fjson.file_name, "id").read_content() == expected
+		# Update by an element that is not the index (changes the index key)
+		fjson.update({"id": 4, "text": "last"}, "text")
+		assert not fjson.search_by_uide(3, "id")["found"]
+		assert fjson.search_by_uide(4, "id")["data"] == {"id": 4, "text": "last"}
+		assert len(TSjsonIndexed(fjson.file_name, "id").read_content()) == 3
+	finally:
+		shutil.rmtree(work_dir)
+
+
+def test_indexed_write_content_replaces_same_uide():
+	'''Adding a record with an existing uide replaces it instead of duplicating it'''
+	work_dir, fjson = new_file(TSjsonIndexed, "id")
+	try:
+		fjson.write_content({"id": 1, "text": "replaced"})
+		assert len(fjson.read_content()) == 3
+		assert fjson.search_by_uide(1, "id")["data"] == {"id": 1, "text": "replaced"}
+	finally:
+		shutil.rmtree(work_dir)
+
+
+def test_indexed_keeps_duplicated_and_not_indexed_records():
+	'''Records with repeated uides or without uides are kept when the file is rewritten'''
+	work_dir = tempfile.mkdtemp()
+	try:
+		file_name = os.path.join(work_dir, "records.json")
+		records = [{"id": 1, "text": "first"}, {"id": 1, "text": "repeated"},
+				{"text": "no id"}, {"text": "no id either"}]
+		TSjson(file_name).write({"Content": records})
+		fjson = TSjsonIndexed(file_name, "id")
+		fjson.write_content({"id": 2, "text": "new"})
+		expected = records + [{"id": 2, "text": "new"}]
+		assert fjson.read_content() == expected
+		assert TSjson(file_name).read_content() == expected
+		# Records that are not indexed are found by a linear search
+		fjson.remove_by_uide("no id", "text")
+		assert len(TSjsonIndexed(file_name, "id").read_content()) == 4
+	finally:
+		shutil.rmtree(work_dir)
+
+
+def test_indexed_returns_copies():
+	'''Modifying returned records does not modify the stored records'''
+	work_dir, fjson = new_file(TSjsonIndexed, "id")
+	try:
+		fjson.read_content()[0]["text"] = "modified"
+		fjson.search_by_uide(2, "id")["data"]["text"] = "modified"
+		assert fjson.read_content() == RECORDS
+	finally:
+		shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+	test_remove_by_uide_keeps_other_records()
+	test_indexed_remove_by_uide_keeps_other_records()
+	test_indexed_update()
+	test_indexed_write_content_replaces_same_uide()
+	test_indexed_keeps_duplicated_and_not_indexed_records()
+	test_indexed_returns_copies()
+	print("All tests passed.")